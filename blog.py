@@ -0,0 +1,174 @@
+import collections
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+from sidepost.models import Post, Category as PostCategory
+
+from .caching import VersionStamp, VersionedValue, slug_set
+from .models import Member
+from .pages import block_lookups
+
+posts_version = VersionStamp('blog:posts')
+# Categories with their own pages, kept out of the blog listings and archive
+EXCLUDED_CATEGORIES = ('history',)
+# Every slug, published or not: blog_detail decides what may be shown (scheduled posts, previews)
+post_slugs = slug_set('blog:slugs', lambda: Post.objects.all(), ttl=getattr(settings, 'BLOG_SLUG_CACHE_TTL', 60 * 5))
+
+
+class CachedCountPaginator(Paginator):
+	"Paginator whose COUNT is shared through the cache under `count_key` until posts change or it expires"
+
+	def __init__(self, object_list, per_page, count_key, **kwargs):
+		super(CachedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+		self.count_key = count_key
+		self._cached_count = None
+
+	@property
+	def count(self):
+		if self._cached_count is None:
+			key = 'goalzero:blog:count:{}:{}'.format(posts_version.version(), hashlib.md5(self.count_key.encode('utf-8')).hexdigest())
+			self._cached_count = cache.get(key)
+			if self._cached_count is None:
+				self._cached_count = self.object_list.count()
+				cache.set(key, self._cached_count, getattr(settings, 'BLOG_COUNT_CACHE_TTL', 60 * 60))
+		return self._cached_count
+
+
+def encode_cursor(post, order, number):
+	"Opaque cursor pointing just past `post` in `order`, for page `number`"
+	value = getattr(post, order.lstrip('-'))
+	return signing.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, post.pk, number], compress=True)
+
+
+def decode_cursor(cursor):
+	"(sort value, pk, page number) from a cursor, or None when it is missing or tampered with"
+	try:
+		value, pk, number = signing.loads(cursor)
+	except (signing.BadSignature, TypeError, ValueError):
+		return None
+	return value, pk, number
+
+
+class KeysetPage(Page):
+	"A Page of posts read after a cursor, numbered like the offset page it replaces"
+
+	def __init__(self, object_list, number, paginator, next_cursor):
+		super(KeysetPage, self).__init__(object_list, number, paginator)
+		self.next_cursor = next_cursor
+
+	def has_next(self):
+		return self.next_cursor is not None
+
+
+def keyset_order(order):
+	"`order` with the pk tie-break keyset pages rely on, so posts sharing a sort value keep one order"
+	return order, '-pk' if order.startswith('-') else 'pk'
+
+
+def keyset_page(queryset, order, cursor, paginator):
+	"""
+	The page of `queryset` that follows `cursor` in `order`, a single field with an optional
+	leading "-". Uses an indexed range instead of OFFSET, so deep pages cost the same.
+	"""
+	value, pk, number = cursor
+	per_page = int(paginator.per_page)
+	field = order.lstrip('-')
+	lookup = 'lt' if order.startswith('-') else 'gt'
+	queryset = queryset.filter(Q(**{'{}__{}'.format(field, lookup): value}) | Q(**{field: value, 'pk__{}'.format(lookup): pk}))
+	posts = list(queryset.order_by(*keyset_order(order))[:per_page + 1])
+	next_cursor = encode_cursor(posts[per_page - 1], order, number + 1) if len(posts) > per_page else None
+	return KeysetPage(posts[:per_page], number, paginator, next_cursor)
+
+
+class BlogTaxonomy(object):
+	"""
+	Every post category keyed by its slug path from the root, and per category (None for
+	the whole blog) how many public posts outside EXCLUDED_CATEGORIES were published in
+	each (year, month). Counts can lag the clock by up to the TTL, so they only feed navigation.
+	"""
+
+	def __init__(self, categories, posts):
+		self.by_pk = {category.pk: category for category in categories}
+		self.paths = {}
+		for category in self.by_pk.values():
+			path = self.path(category)
+			if path:
+				self.paths[path] = category
+
+		self.histograms = {}
+		counted = set()
+		for pk, category_id, publish_date in posts:
+			if publish_date is None:
+				continue
+			month = (publish_date.year, publish_date.month)
+			if category_id is not None:
+				histogram = self.histograms.setdefault(category_id, {})
+				histogram[month] = histogram.get(month, 0) + 1
+			if pk not in counted:
+				counted.add(pk)
+				histogram = self.histograms.setdefault(None, {})
+				histogram[month] = histogram.get(month, 0) + 1
+
+	@classmethod
+	def build(cls):
+		posts = Post.objects.public().exclude(categories__slug__in=EXCLUDED_CATEGORIES)
+		return cls(PostCategory.objects.all(), posts.values_list('pk', 'categories', 'publish_date'))
+
+	def path(self, category):
+		"Slugs from the root down to `category`, or None for a broken parent chain"
+		slugs = []
+		seen = set()
+		while category is not None:
+			if category.pk in seen:
+				return None
+			seen.add(category.pk)
+			slugs.append(category.slug)
+			if category.parent_id is None:
+				break
+			category = self.by_pk.get(category.parent_id)
+			if category is None:
+				return None
+		return tuple(reversed(slugs))
+
+	def category(self, path):
+		"The category at slug `path`, or None"
+		return self.paths.get(tuple(path))
+
+	def archive(self, category=None):
+		"[(year, [(month, count), ...]), ...] newest first, for archive navigation"
+		years = {}
+		for (year, month), count in self.histograms.get(category.pk if category else None, {}).items():
+			years.setdefault(year, []).append((month, count))
+		return [(year, sorted(years[year], reverse=True)) for year in sorted(years, reverse=True)]
+
+
+blog_taxonomy = VersionedValue('blog:taxonomy', BlogTaxonomy.build, ttl=getattr(settings, 'BLOG_TAXONOMY_CACHE_TTL', 60 * 5))
+
+
+def story_prefetch():
+	"""
+	Post relations the story template walks: its GenericRelations and many-to-many
+	fields, categories among them. STORY_POST_PREFETCH replaces the list.
+	"""
+	lookups = getattr(settings, 'STORY_POST_PREFETCH', None)
+	if lookups is None:
+		lookups = block_lookups(Post)
+	return lookups
+
+
+def build_story_timeline():
+	"History posts grouped by publish year, oldest first, plus the members shown on the story page"
+	posts = Post.objects.public().filter(categories__slug='history').order_by('publish_date')
+	history = collections.OrderedDict()
+	for post in posts.prefetch_related(*story_prefetch()):
+		history.setdefault(post.publish_date.year, []).append(post)
+	members = Member.objects.filter(categories__name="members").prefetch_related('categories', 'gallery')
+	return {'history_categories': history, 'story_members': list(members)}
+
+
+story_timeline = VersionedValue('story:timeline', build_story_timeline, ttl=getattr(settings, 'STORY_TIMELINE_CACHE_TTL', 60 * 5))
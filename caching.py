@@ -0,0 +1,116 @@
+import collections
+import threading
+import time
+
+from django.core.cache import caches
+
+_MISSING = object()
+
+
+class LRUCache(object):
+	"Thread-safe, size-bounded in-process cache with optional per-entry expiry"
+
+	def __init__(self, size=1024, ttl=None):
+		self.size = size
+		self.ttl = ttl
+		self._data = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._data)
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				expires, value = self._data[key]
+			except KeyError:
+				return default
+			if expires is not None and expires < time.time():
+				del self._data[key]
+				return default
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key, value, ttl=_MISSING):
+		ttl = self.ttl if ttl is _MISSING else ttl
+		with self._lock:
+			self._data[key] = (time.time() + ttl if ttl else None, value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.size:
+				self._data.popitem(last=False)
+
+	def delete(self, key):
+		with self._lock:
+			self._data.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+
+class VersionStamp(object):
+	"Shared counter for `name` that moves on every invalidation, for use in cache keys"
+
+	def __init__(self, name, backend='default'):
+		self.name = name
+		self.backend = backend
+
+	@property
+	def key(self):
+		return 'goalzero:version:{}'.format(self.name)
+
+	def version(self):
+		cache = caches[self.backend]
+		version = cache.get(self.key)
+		if version is None:
+			# Seed with the clock so a stamp lost to eviction never matches an older one
+			cache.add(self.key, int(time.time() * 1000), None)
+			version = cache.get(self.key)
+		return version
+
+	def invalidate(self):
+		cache = caches[self.backend]
+		try:
+			cache.incr(self.key)
+		except ValueError:
+			cache.set(self.key, int(time.time() * 1000), None)
+
+
+class VersionedValue(VersionStamp):
+	"""
+	Process-local value produced by `builder` and rebuilt whenever the shared version stamp
+	for `name` moves, so an invalidation in one worker reaches every worker on its next read.
+	With `ttl` it is also rebuilt once it is that many seconds old, for values that depend on
+	the clock (scheduled publish dates) as well as on saves.
+	"""
+
+	def __init__(self, name, builder, backend='default', ttl=None):
+		super(VersionedValue, self).__init__(name, backend)
+		self.builder = builder
+		self.ttl = ttl
+		self._value = None
+		self._version = _MISSING
+		self._expires = None
+		self._lock = threading.Lock()
+
+	def stale(self, version):
+		return version != self._version or (self._expires is not None and self._expires < time.time())
+
+	def get(self):
+		version = self.version()
+		if self.stale(version):
+			with self._lock:
+				if self.stale(version):
+					self._value = self.builder()
+					self._version = version
+					self._expires = time.time() + self.ttl if self.ttl else None
+		return self._value
+
+	def invalidate(self):
+		super(VersionedValue, self).invalidate()
+		self._version = _MISSING
+
+
+def slug_set(name, queryset, ttl=None):
+	"VersionedValue holding the slugs of `queryset()` as a frozenset"
+	return VersionedValue(name, lambda: frozenset(queryset().values_list('slug', flat=True)), ttl=ttl)
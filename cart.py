@@ -0,0 +1,105 @@
+import collections
+from decimal import Decimal
+
+from django.db import transaction
+from django.http import Http404
+from django.utils.translation import ugettext_lazy as _
+
+from sidecart.orders.signals import cart_change
+from sidecart.products.models import Item, Variation
+
+
+def resolve_lines(lines):
+	"""
+	Find the Item for each requested line (a dict of variation_id, item_id and quantity),
+	loading every Variation and every Item with one query each.
+	Returns a list of (variation, item, quantity) tuples.
+	"""
+	variations = Variation.objects.public().in_bulk({line['variation_id'] for line in lines if line['variation_id']})
+	items = Item.objects.in_bulk({line['item_id'] for line in lines if line['item_id']})
+
+	# Variations without sizes add their first item
+	defaults = {}
+	sizeless = [variation.pk for variation in variations.values() if not variation.has_items]
+	if sizeless:
+		for item in Item.objects.filter(variation__in=sizeless).order_by('-pk'):
+			defaults[item.variation_id] = item
+
+	resolved = []
+	for line in lines:
+		variation = variations.get(line['variation_id'])
+		if variation and not variation.has_items:
+			item = defaults.get(variation.pk)
+		elif variation and not line['item_id']:
+			raise AttributeError(_("Please select a size!"))
+		else:
+			item = items.get(line['item_id'])
+		if item is None:
+			raise Http404
+		resolved.append((variation, item, line['quantity']))
+	return resolved
+
+
+def add_lines(request, lines, update=True, vars=None):
+	"Add every requested line to the cart in one transaction and send cart_change once"
+	resolved = resolve_lines(lines)
+	with transaction.atomic():
+		request.cart.previous_items = list(request.cart.items.all())
+		added_items = [request.cart.add(item, quantity, update=update, vars=vars or {}) for variation, item, quantity in resolved]
+	cart_change.send(sender='cart.change', cart=request.cart, request=request)
+	return added_items
+
+
+SUMMARY_SESSION_KEY = 'goalzero_cart_summary'
+
+
+def line_total(line):
+	return line.price * line.quantity
+
+
+def cart_summary(request):
+	"Line count, item count and subtotal of the cart, kept in the session until the cart changes"
+	summary = request.session.get(SUMMARY_SESSION_KEY)
+	if summary is None or summary['cart'] != request.cart.pk:
+		lines = list(request.cart.items.all())
+		summary = {
+			'cart': request.cart.pk,
+			'lines': len(lines),
+			'count': sum(line.quantity for line in lines),
+			'subtotal': str(sum((line_total(line) for line in lines), Decimal('0'))),
+		}
+		request.session[SUMMARY_SESSION_KEY] = summary
+	return summary
+
+
+def cart_delta(request, summary, added_items):
+	"""
+	Fold the lines just added into `summary`, which must be the summary from before the add,
+	and return the compact update the mini cart needs. The new summary is saved to the session.
+	Requested lines that landed on the same cart line count once, in their final state.
+	"""
+	previous = {line.pk: line for line in request.cart.previous_items}
+	final = collections.OrderedDict((line.pk, line) for line in added_items)
+	summary = dict(summary)
+	added = []
+	for line in final.values():
+		before = previous.get(line.pk)
+		quantity = before.quantity if before else 0
+		total = line_total(before) if before else Decimal('0')
+		if not before:
+			summary['lines'] += 1
+		summary['count'] += line.quantity - quantity
+		summary['subtotal'] = str(Decimal(summary['subtotal']) + line_total(line) - total)
+		added.append({
+			'id': line.pk,
+			'item_id': line.item_id,
+			'quantity': line.quantity,
+			'change': line.quantity - quantity,
+			'total': str(line_total(line)),
+		})
+	request.session[SUMMARY_SESSION_KEY] = summary
+	return {'added': added, 'lines': summary['lines'], 'count': summary['count'], 'subtotal': summary['subtotal']}
+
+
+def forget_cart_summary(request):
+	request.session.pop(SUMMARY_SESSION_KEY, None)
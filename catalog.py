@@ -0,0 +1,125 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from sidecart.products.models import Category, Item, Product, Variation
+
+from .caching import VersionedValue
+from .pages import block_lookups
+
+LANDING_PRODUCTS = 3
+
+
+def build_landing_ids():
+	"Ids of the first few public products in each shop category, in default product order"
+	ids = {}
+	rows = Product.objects.public().filter(categories__parent__slug='shop').values_list('categories', 'pk')
+	for category_id, pk in rows:
+		products = ids.setdefault(category_id, [])
+		if len(products) < LANDING_PRODUCTS and pk not in products:
+			products.append(pk)
+	return ids
+
+
+landing_product_ids = VersionedValue('products:landing', build_landing_ids)
+
+
+def reverse_accessor(model, related_model):
+	"Name of the reverse foreign key accessor from `model` to `related_model` (e.g. item_set)"
+	for field in model._meta.get_fields():
+		if field.auto_created and not field.concrete and field.related_model is related_model:
+			return field.get_accessor_name()
+	return None
+
+
+def landing_prefetch():
+	"""
+	Product relations the landing tiles walk: images and categories, variations and their
+	items. PRODUCT_LANDING_PREFETCH replaces the list.
+	"""
+	lookups = getattr(settings, 'PRODUCT_LANDING_PREFETCH', None)
+	if lookups is None:
+		lookups = block_lookups(Product)
+		variations = reverse_accessor(Product, Variation)
+		if variations:
+			lookups.append(variations)
+			items = reverse_accessor(Variation, Item)
+			if items:
+				lookups.append('{}__{}'.format(variations, items))
+	return lookups
+
+
+def attach_landing_products(categories):
+	"Set `prefetched_products` on every category, loading all of them with one query"
+	ids = landing_product_ids.get()
+	pks = {pk for category in categories for pk in ids.get(category.pk, ())}
+	products = Product.objects.public().filter(pk__in=pks).prefetch_related(*landing_prefetch())
+	products = {product.pk: product for product in products}
+	for category in categories:
+		category.prefetched_products = [products[pk] for pk in ids.get(category.pk, ()) if pk in products]
+	return categories
+
+
+MEDIA_CACHE_TTL = getattr(settings, 'PRODUCT_MEDIA_CACHE_TTL', 60 * 60 * 24)
+
+
+def media_key(pk):
+	return 'goalzero:products:media:{}'.format(pk)
+
+
+def media_entry(product):
+	"(code, thumb url, product url), or an empty tuple for a product without a thumbnail"
+	thumb = product.thumb()
+	return (product.code, thumb.url, product.url()) if thumb else ()
+
+
+def load_media_manifest():
+	"""
+	Every product's code -> (thumb url, product url) as JSON. Entries are cached per product,
+	read with one multi-get and built only for products missing from the cache.
+	"""
+	pks = list(Product.objects.values_list('pk', flat=True))
+	keys = {pk: media_key(pk) for pk in pks}
+	entries = cache.get_many(list(keys.values()))
+	missing = [pk for pk in pks if keys[pk] not in entries]
+	if missing:
+		fresh = {keys[product.pk]: media_entry(product) for product in Product.objects.filter(pk__in=missing)}
+		cache.set_many(fresh, MEDIA_CACHE_TTL)
+		entries.update(fresh)
+	manifest = (entries.get(keys[pk]) for pk in pks)
+	return json.dumps({entry[0]: (entry[1], entry[2]) for entry in manifest if entry})
+
+
+media_manifest = VersionedValue('products:media', load_media_manifest)
+
+
+def update_media_manifest(product, deleted=False):
+	"Replace one product's manifest entry and have every process pick up the new version"
+	if deleted:
+		cache.delete(media_key(product.pk))
+	else:
+		cache.set(media_key(product.pk), media_entry(product), MEDIA_CACHE_TTL)
+	media_manifest.invalidate()
+
+
+def related_ordering(prefix, model):
+	"`model`'s default ordering, then its pk, as order_by() terms reached through `prefix`"
+	fields = [field for field in model._meta.ordering if isinstance(field, str)] + ['pk']
+	return ['-' + prefix + field[1:] if field.startswith('-') else prefix + field for field in fields]
+
+
+def build_registration_catalog():
+	"""
+	Shop category name -> [(variation name, code), ...] as JSON for the registration form, in
+	the order of walking each category's public products and each product's public variations.
+	"""
+	catalog = {name: [] for name in Category.objects.filter(parent__slug='shop').values_list('name', flat=True)}
+	variations = Variation.objects.public().filter(product__in=Product.objects.public(), product__categories__parent__slug='shop')
+	order = related_ordering('product__categories__', Category) + related_ordering('product__', Product) + related_ordering('', Variation)
+	for category, name, code in variations.order_by(*order).values_list('product__categories__name', 'name', 'code'):
+		catalog.setdefault(category, []).append((name, code))
+	return json.dumps(catalog)
+
+
+registration_catalog = VersionedValue('registration:catalog', build_registration_catalog)
@@ -0,0 +1,244 @@
+import bisect
+import collections
+import csv
+import hashlib
+import logging
+import numpy as np
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from geopy.exc import GeocoderTimedOut
+from geopy.geocoders import GoogleV3
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import LRUCache
+
+GeocodeResult = collections.namedtuple('GeocodeResult', ('address', 'latitude', 'longitude'))
+
+logger = logging.getLogger(__name__)
+
+_query_re = re.compile(r'[\s,]+')
+_zip_re = re.compile(r'^(\d{5})(?:-\d{4})?$')
+_place_suffix_re = re.compile(r'\s+(?:city and borough|consolidated government|metropolitan government|unified government|city|town|township|village|borough|municipality|CDP|comunidad|zona urbana)(?:\s+\(balance\))?$')
+
+
+def normalize_query(query):
+	"Collapse case, whitespace and comma differences so equivalent searches share a cache entry"
+	return _query_re.sub(' ', query).strip().lower()
+
+
+class Gazetteer(object):
+	"""
+	Offline lookup of US ZIP codes and "City, ST" names from a tab separated file of
+	`key, latitude, longitude, address` rows. Keys are kept sorted for exact and prefix
+	lookups, coordinates in packed float arrays, and the file is read on first use.
+	"""
+
+	def __init__(self, path=None):
+		self.path = path or getattr(settings, 'STORELOCATOR_GAZETTEER_PATH', os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.tsv'))
+		self._keys = None
+		self._lock = threading.Lock()
+
+	def load(self):
+		rows = []
+		if os.path.exists(self.path):
+			with open(self.path, encoding='utf-8', newline='') as data:
+				for key, latitude, longitude, address in csv.reader(data, delimiter='\t'):
+					rows.append((normalize_query(key), float(latitude), float(longitude), address))
+		else:
+			logger.warning('Gazetteer file %s is missing, every store finder search will go to the remote geocoder; run build_gazetteer to create it', self.path)
+		rows.sort(key=lambda row: row[0])
+		self.lats = np.array([row[1] for row in rows], dtype=np.float32)
+		self.lngs = np.array([row[2] for row in rows], dtype=np.float32)
+		self.addresses = [row[3] for row in rows]
+		self._keys = [row[0] for row in rows]
+
+	def keys(self):
+		if self._keys is None:
+			with self._lock:
+				if self._keys is None:
+					self.load()
+		return self._keys
+
+	def result(self, i):
+		return GeocodeResult(self.addresses[i], round(float(self.lats[i]), 5), round(float(self.lngs[i]), 5))
+
+	def geocode(self, query):
+		"Resolve a ZIP or city query locally, or return None so the caller can go remote"
+		keys = self.keys()
+		normalized = normalize_query(query)
+		match = _zip_re.match(normalized)
+		if match:
+			normalized = match.group(1)
+
+		i = bisect.bisect_left(keys, normalized)
+		if i < len(keys) and keys[i] == normalized:
+			return self.result(i)
+
+		# A city without its state is accepted only when the prefix is unambiguous
+		if not match and normalized:
+			prefix = normalized + ' '
+			i = bisect.bisect_left(keys, prefix)
+			j = bisect.bisect_left(keys, prefix + '\uffff')
+			if j - i == 1:
+				return self.result(i)
+		return None
+
+
+gazetteer = Gazetteer()
+
+
+def _census_rows(infile):
+	"Rows of a Census Bureau gazetteer file, with the padding stripped from its header names"
+	reader = csv.reader(infile, delimiter='\t')
+	header = [name.strip() for name in next(reader)]
+	for row in reader:
+		yield dict(zip(header, (value.strip() for value in row)))
+
+
+def gazetteer_rows(zcta=None, places=None):
+	"""
+	`key, latitude, longitude, address` rows for a Gazetteer file, built from the Census
+	Bureau's ZCTA and places gazetteer files (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html).
+	ZIP codes are keyed by number, places by "name state", the first of any duplicates kept.
+	"""
+	seen = set()
+	if zcta is not None:
+		for row in _census_rows(zcta):
+			key = row['GEOID']
+			if key not in seen:
+				seen.add(key)
+				yield key, row['INTPTLAT'], row['INTPTLONG'], '{}, USA'.format(key)
+	if places is not None:
+		for row in _census_rows(places):
+			name = _place_suffix_re.sub('', row['NAME'])
+			key = normalize_query('{} {}'.format(name, row['USPS']))
+			if key not in seen:
+				seen.add(key)
+				yield key, row['INTPTLAT'], row['INTPTLONG'], '{}, {}, USA'.format(name, row['USPS'])
+
+
+class GeocodeCache(object):
+	"""
+	Geocoder front end that checks an in-process LRU, then a shared cache backend, before
+	going to the remote geocoder. "Not found" answers are cached too, for a shorter time;
+	geocoder errors (quota, timeouts) propagate and are never cached.
+
+	ZIP and city queries the `gazetteer` knows are answered locally without touching
+	either cache. Any object with a geopy style `geocode(query)` method can be passed
+	as `geocoder`.
+
+	Remote lookups run on a small pool capped at `concurrency` outstanding calls;
+	concurrent requests for the same query share one call, and callers give up with
+	GeocoderTimedOut `timeout` seconds after asking, whether they spent it waiting for a
+	slot or for the answer (a late answer is still cached).
+	"""
+
+	def __init__(self, geocoder=None, gazetteer=None, backend=None, size=None, ttl=None, negative_ttl=None, timeout=None, concurrency=None):
+		self.geocoder = geocoder
+		self.gazetteer = gazetteer
+		self.backend = backend or getattr(settings, 'STORELOCATOR_GEOCODE_CACHE', 'default')
+		self.ttl = ttl or getattr(settings, 'STORELOCATOR_GEOCODE_CACHE_TTL', 60 * 60 * 24 * 30)
+		self.negative_ttl = negative_ttl or getattr(settings, 'STORELOCATOR_GEOCODE_NEGATIVE_TTL', 60 * 60)
+		self.local = LRUCache(size or getattr(settings, 'STORELOCATOR_GEOCODE_LRU_SIZE', 1024))
+		self.stats = collections.Counter()
+		self.timeout = timeout or getattr(settings, 'STORELOCATOR_GEOCODE_TIMEOUT', 5)
+		concurrency = concurrency or getattr(settings, 'STORELOCATOR_GEOCODE_CONCURRENCY', 8)
+		self._slots = threading.BoundedSemaphore(concurrency)
+		self._executor = ThreadPoolExecutor(max_workers=concurrency)
+		self._inflight = {}
+		self._inflight_lock = threading.Lock()
+
+	def key(self, normalized):
+		return 'goalzero:geocode:{}'.format(hashlib.md5(normalized.encode('utf-8')).hexdigest())
+
+	def remote(self, query):
+		geocoder = self.geocoder or GoogleV3(api_key=settings.Site.google_api_key)
+		result = geocoder.geocode(query)
+		if result is None:
+			return None
+		return GeocodeResult(result.address, result.latitude, result.longitude)
+
+	def store(self, normalized, value):
+		ttl = self.ttl if value else self.negative_ttl
+		caches[self.backend].set(self.key(normalized), value, ttl)
+		self.local.set(normalized, value, ttl)
+
+	def run(self, query, normalized, future):
+		try:
+			result = self.remote(query)
+			value = tuple(result) if result else ()
+			self.store(normalized, value)
+		except Exception as exp:
+			future.set_exception(exp)
+		else:
+			future.set_result(value)
+		finally:
+			self._slots.release()
+			with self._inflight_lock:
+				self._inflight.pop(normalized, None)
+
+	def fetch(self, query, normalized):
+		"Look `query` up remotely, joining an identical lookup already in flight"
+		deadline = time.monotonic() + self.timeout
+		with self._inflight_lock:
+			future = self._inflight.get(normalized)
+			leader = future is None
+			if leader:
+				future = self._inflight[normalized] = Future()
+			else:
+				self.stats['coalesced'] += 1
+
+		if leader:
+			if self._slots.acquire(timeout=self.timeout):
+				self._executor.submit(self.run, query, normalized, future)
+			else:
+				with self._inflight_lock:
+					self._inflight.pop(normalized, None)
+				future.set_exception(GeocoderTimedOut('Too many geocoder requests outstanding'))
+
+		try:
+			return future.result(timeout=max(deadline - time.monotonic(), 0))
+		except TimeoutError:
+			self.stats['timeouts'] += 1
+			raise GeocoderTimedOut('Geocoder did not answer within {} seconds'.format(self.timeout))
+
+	def geocode(self, query):
+		normalized = normalize_query(query)
+		if not normalized:
+			return None
+
+		if self.gazetteer is not None:
+			result = self.gazetteer.geocode(query)
+			if result is not None:
+				self.stats['gazetteer_hits'] += 1
+				return result
+
+		# Entries are stored as plain tuples, an empty tuple meaning "not found"
+		value = self.local.get(normalized)
+		if value is not None:
+			self.stats['local_hits'] += 1
+		else:
+			value = caches[self.backend].get(self.key(normalized))
+			if value is not None:
+				self.stats['shared_hits'] += 1
+				self.local.set(normalized, value, self.ttl if value else self.negative_ttl)
+			else:
+				self.stats['misses'] += 1
+				value = self.fetch(query, normalized)
+
+		if not value:
+			self.stats['not_found'] += 1
+			return None
+		return GeocodeResult(*value)
+
+
+geocode_cache = GeocodeCache(gazetteer=gazetteer)
+
+
+def geocode(query):
+	return geocode_cache.geocode(query)
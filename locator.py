@@ -0,0 +1,246 @@
+import hashlib
+import itertools
+import json
+import math
+import numpy as np
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+from sidecart.products.models import Product
+from storelocator.models import Location, Category as LocatorCategory
+from storelocator.serializers import LocationSerializer
+
+from .caching import LRUCache, VersionedValue, slug_set
+
+EARTH_RADIUS_MILES = 3958.7613
+KM_PER_MILE = 1.609344
+TILE_SIZE = 256
+CLUSTER_CELL_SIZE = 64
+INVENTORY_CACHE_TTL = getattr(settings, 'STORELOCATOR_INVENTORY_CACHE_TTL', 60 * 10)
+
+_serials = itertools.count()
+
+
+def haversine_miles(latitude, longitude, lats, lngs):
+	"Great-circle miles from one point (degrees) to arrays of points (radians)"
+	latitude, longitude = math.radians(latitude), math.radians(longitude)
+	a = np.sin((lats - latitude) / 2) ** 2 + math.cos(latitude) * np.cos(lats) * np.sin((lngs - longitude) / 2) ** 2
+	return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class StoreIndex(object):
+	"Coordinates of every active physical Location held in arrays for radius and nearest-k queries"
+
+	def __init__(self, rows, memberships=()):
+		self.serial = next(_serials)
+		rows = list(rows)
+		self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+		self.lats = np.radians(np.array([float(row[1]) for row in rows], dtype=np.float64))
+		self.lngs = np.radians(np.array([float(row[2]) for row in rows], dtype=np.float64))
+		self.positions = {pk: i for i, pk in enumerate(self.ids.tolist())}
+
+		categories = {}
+		for pk, category_id in memberships:
+			if pk in self.positions:
+				categories.setdefault(category_id, set()).add(self.positions[pk])
+		self.categories = {k: np.array(sorted(v), dtype=np.int64) for k, v in categories.items()}
+		self._clusters = None
+
+	@classmethod
+	def build(cls):
+		stores = Location.objects.active().exclude(online=True)
+		rows = stores.exclude(latitude=None).exclude(longitude=None).values_list('pk', 'latitude', 'longitude')
+		memberships = stores.filter(categories__isnull=False).values_list('pk', 'categories')
+		return cls(rows, memberships)
+
+	def clusters(self):
+		"Cluster pyramid for this index, built on first use"
+		if self._clusters is None:
+			self._clusters = ClusterPyramid(self)
+		return self._clusters
+
+	def candidates(self, categories=None, mask=None):
+		"Index positions to search, limited to stores in any of `categories` and set in `mask` when given"
+		if categories is None:
+			positions = np.arange(len(self.ids))
+		else:
+			parts = [self.categories[c] for c in categories if c in self.categories]
+			positions = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+		if mask is not None:
+			positions = positions[mask[positions]]
+		return positions
+
+	def within_radius(self, location, radius, categories=None, mask=None):
+		"Return (ids, miles) for stores within `radius` miles of `location`, nearest first"
+		positions = self.candidates(categories, mask)
+		miles = haversine_miles(location[0], location[1], self.lats[positions], self.lngs[positions])
+		mask = miles <= radius
+		positions, miles = positions[mask], miles[mask]
+		order = np.argsort(miles, kind='mergesort')
+		return self.ids[positions[order]], miles[order]
+
+	def nearest(self, location, k=1, categories=None):
+		"Return (ids, miles) for the `k` stores closest to `location`, nearest first"
+		positions = self.candidates(categories)
+		miles = haversine_miles(location[0], location[1], self.lats[positions], self.lngs[positions])
+		if k < len(miles):
+			subset = np.argpartition(miles, k)[:k]
+		else:
+			subset = np.arange(len(miles))
+		order = subset[np.argsort(miles[subset], kind='mergesort')]
+		return self.ids[positions[order]], miles[order]
+
+
+class ClusterPyramid(object):
+	"""
+	Grid clusters of every store in a StoreIndex for zoom levels 0 to `max_zoom`, grouped
+	by the web mercator map tile they fall in. Past `max_zoom` every store is its own marker.
+	"""
+
+	def __init__(self, index, max_zoom=None, cell_size=CLUSTER_CELL_SIZE):
+		self.index = index
+		self.max_zoom = max_zoom if max_zoom is not None else getattr(settings, 'STORELOCATOR_CLUSTER_MAX_ZOOM', 14)
+		self.cell_size = cell_size
+		# Normalised mercator coordinates, 0..1 across the world map
+		lats = np.clip(index.lats, -1.4844, 1.4844)
+		self.x = (index.lngs + math.pi) / (2 * math.pi)
+		self.y = (1 - np.log(np.tan(lats) + 1 / np.cos(lats)) / math.pi) / 2
+		self.levels = [self.level(zoom) for zoom in range(self.max_zoom + 1)]
+
+	def marker(self, i, count, lat, lng):
+		marker = {'lat': round(math.degrees(lat), 6), 'lng': round(math.degrees(lng), 6), 'count': count}
+		if count == 1:
+			marker['id'] = int(self.index.ids[i])
+		return marker
+
+	def level(self, zoom):
+		cells = TILE_SIZE * 2 ** zoom // self.cell_size
+		per_tile = TILE_SIZE // self.cell_size
+		cx = np.minimum((self.x * cells).astype(np.int64), cells - 1)
+		cy = np.minimum((self.y * cells).astype(np.int64), cells - 1)
+		keys, inverse, counts = np.unique(cy * cells + cx, return_inverse=True, return_counts=True)
+		lats = np.bincount(inverse, weights=self.index.lats, minlength=len(keys)) / np.maximum(counts, 1)
+		lngs = np.bincount(inverse, weights=self.index.lngs, minlength=len(keys)) / np.maximum(counts, 1)
+		members = np.zeros(len(keys), dtype=np.int64)
+		members[inverse] = np.arange(len(inverse))
+
+		tiles = {}
+		for i, key in enumerate(keys.tolist()):
+			tile = ((key % cells) // per_tile, (key // cells) // per_tile)
+			tiles.setdefault(tile, []).append(self.marker(members[i], int(counts[i]), lats[i], lngs[i]))
+		return tiles
+
+	def tile(self, zoom, x, y):
+		"Markers inside map tile `x`, `y` at `zoom`"
+		if zoom <= self.max_zoom:
+			return self.levels[zoom].get((x, y), [])
+		scale = 2 ** zoom
+		inside = np.flatnonzero((np.floor(self.x * scale) == x) & (np.floor(self.y * scale) == y))
+		return [self.marker(i, 1, self.index.lats[i], self.index.lngs[i]) for i in inside.tolist()]
+
+
+class InventoryIndex(object):
+	"""
+	Which stores carry a product, variation, item or filtered set of variations, kept as
+	packed bitsets over StoreIndex positions. Each bitset is computed with one
+	`with_inventory` query the first time it is asked for and reused until inventory
+	or the store index changes, or for at most `ttl` seconds so bulk feed updates that
+	send no signals are picked up too.
+	"""
+
+	def __init__(self, size=512, ttl=None):
+		self.bitsets = LRUCache(size, ttl or INVENTORY_CACHE_TTL)
+
+	def mask(self, index, variations=None, product_slug=None, variation_slug=None, item_slug=None):
+		"Boolean array over `index` positions, True where the store has the requested inventory"
+		if variations is not None:
+			key = (index.serial, 'variations') + tuple(sorted(variations.values_list('pk', flat=True)))
+		else:
+			key = (index.serial, product_slug, variation_slug, item_slug)
+
+		bits = self.bitsets.get(key)
+		if bits is None:
+			stores = Location.objects.active().exclude(online=True)
+			pks = stores.with_inventory(variations, product_slug, variation_slug, item_slug).values_list('pk', flat=True)
+			mask = np.zeros(len(index.ids), dtype=bool)
+			mask[[index.positions[pk] for pk in set(pks) if pk in index.positions]] = True
+			bits = np.packbits(mask)
+			self.bitsets.set(key, bits)
+		return np.unpackbits(bits, count=len(index.ids)).astype(bool)
+
+
+def inventory_models():
+	"""
+	Models whose saves invalidate `inventory_index`: STORELOCATOR_INVENTORY_MODELS labels when
+	set, otherwise every model pointing at Location other than its own subclasses.
+	"""
+	labels = getattr(settings, 'STORELOCATOR_INVENTORY_MODELS', None)
+	if labels is not None:
+		return frozenset(apps.get_model(label) for label in labels)
+	related = (field.related_model for field in Location._meta.get_fields() if field.auto_created and not field.concrete)
+	return frozenset(model for model in related if model is not None and not issubclass(model, Location))
+
+
+store_index = VersionedValue('storelocator:index', StoreIndex.build)
+inventory_index = VersionedValue('storelocator:inventory', InventoryIndex)
+category_slugs = slug_set('storelocator:categories', lambda: LocatorCategory.objects.filter(active=True))
+product_slugs = slug_set('storelocator:products', lambda: Product.objects.all())
+
+
+def annotate(queryset, ids, miles):
+	"Load `ids` from `queryset` in the given order with `distance` (whole miles) and `distance_km` set"
+	ids, miles = ids.tolist(), miles.tolist()
+	stores = queryset.in_bulk(ids)
+	results = []
+	for pk, distance in zip(ids, miles):
+		store = stores.get(pk)
+		if store is not None:
+			store.distance = int(distance)
+			store.distance_km = distance * KM_PER_MILE
+			results.append(store)
+	return results
+
+
+def fragment_key(pk):
+	return 'goalzero:store-json:{}'.format(pk)
+
+
+def store_fragments(stores):
+	"JSON for each store, serialized once and shared through the cache, with its distance spliced in"
+	stores = list(stores)
+	keys = {store.pk: fragment_key(store.pk) for store in stores}
+	fragments = cache.get_many(list(keys.values()))
+	missing = [store for store in stores if keys[store.pk] not in fragments]
+	if missing:
+		fresh = {keys[store.pk]: json.dumps(data) for store, data in zip(missing, LocationSerializer(missing, many=True).data)}
+		cache.set_many(fresh, getattr(settings, 'STORELOCATOR_FRAGMENT_CACHE_TTL', 60 * 60 * 24))
+		fragments.update(fresh)
+
+	for store in stores:
+		fragment = fragments[keys[store.pk]]
+		if hasattr(store, 'distance_km'):
+			fragment = '{}, "distance": {}}}'.format(fragment[:-1], store.distance)
+		yield fragment
+
+
+def stream_json(context, key, fragments):
+	"Yield `context` as JSON, with `key` holding the already serialized `fragments` as an array"
+	context = dict(context)
+	context.pop(key, None)
+	yield '{}, {}: ['.format(json.dumps(context)[:-1], json.dumps(key))
+	for i, fragment in enumerate(fragments):
+		yield ',' + fragment if i else fragment
+	yield ']}'
+
+
+def search_etag(request):
+	"""
+	ETag for a store search; it changes whenever stores or inventory change, and at least once
+	per inventory TTL so stock picked up by bitset expiry is never answered with a 304
+	"""
+	bucket = int(time.time() // INVENTORY_CACHE_TTL)
+	state = '{}:{}:{}:{}'.format(store_index.version(), inventory_index.version(), bucket, request.get_full_path())
+	return '"{}"'.format(hashlib.md5(state.encode('utf-8')).hexdigest())
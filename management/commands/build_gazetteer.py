@@ -0,0 +1,36 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from goalzero.geocoding import gazetteer, gazetteer_rows
+
+
+class Command(BaseCommand):
+	help = 'Build the offline store finder gazetteer from Census Bureau ZCTA and places gazetteer files'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--zcta', help='Census ZCTA gazetteer file (e.g. 2023_Gaz_zcta_national.txt)')
+		parser.add_argument('--places', help='Census places gazetteer file (e.g. 2023_Gaz_place_national.txt)')
+		parser.add_argument('--output', default=None, help='File to write, STORELOCATOR_GAZETTEER_PATH by default')
+
+	def handle(self, *args, **options):
+		if not options['zcta'] and not options['places']:
+			raise CommandError('Give at least one of --zcta and --places')
+
+		path = options['output'] or gazetteer.path
+		if os.path.dirname(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+
+		sources = {name: open(options[name], encoding='utf-8', newline='') for name in ('zcta', 'places') if options[name]}
+		try:
+			count = 0
+			with open(path, 'w', encoding='utf-8', newline='') as outfile:
+				writer = csv.writer(outfile, delimiter='\t', lineterminator='\n')
+				for row in gazetteer_rows(**sources):
+					writer.writerow(row)
+					count += 1
+		finally:
+			for infile in sources.values():
+				infile.close()
+		self.stdout.write('Wrote {} gazetteer entries to {}'.format(count, path))
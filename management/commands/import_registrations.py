@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from goalzero.registration import EXPORT_MODELS, export_model, import_rows, read_rows
+
+
+class Command(BaseCommand):
+	help = 'Bulk import registrations or registered products from a CSV or NDJSON export'
+
+	def add_arguments(self, parser):
+		parser.add_argument('model', choices=sorted(EXPORT_MODELS))
+		parser.add_argument('path', help='File to read, or - for stdin')
+		parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--keep-ids', action='store_true', default=None, help='Keep primary keys from the file (the default for registrations, so products still point at them)')
+		parser.add_argument('--new-ids', action='store_false', dest='keep_ids', help='Assign new primary keys instead')
+
+	def handle(self, *args, **options):
+		if options['batch_size'] < 1:
+			raise CommandError('--batch-size must be at least 1')
+
+		def progress(count):
+			self.stderr.write('Imported {} rows'.format(count))
+
+		model = export_model(options['model'])
+		keep_ids = options['keep_ids'] if options['keep_ids'] is not None else options['model'] == 'registration'
+		infile = sys.stdin if options['path'] == '-' else open(options['path'], newline='')
+		try:
+			count = import_rows(model, read_rows(infile, options['format']), options['batch_size'], keep_ids, progress)
+		except ValueError as exp:
+			raise CommandError('Nothing imported: {}'.format(exp))
+		finally:
+			if infile is not sys.stdin:
+				infile.close()
+		self.stdout.write('Imported {} {} rows'.format(count, options['model']))
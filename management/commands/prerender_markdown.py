@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from goalzero.markup import render_markdown
+from goalzero.models import FounderBlock, Member, TextBlock
+
+MARKDOWN_FIELDS = (
+	(Member, 'content'),
+	(FounderBlock, 'description'),
+	(TextBlock, 'content'),
+)
+
+
+class Command(BaseCommand):
+	help = 'Render every markdown field into the shared markdown cache ahead of traffic'
+
+	def handle(self, *args, **options):
+		for model, field in MARKDOWN_FIELDS:
+			count = 0
+			for text in model._default_manager.exclude(**{field: None}).values_list(field, flat=True).iterator():
+				render_markdown(text)
+				count += 1
+			self.stdout.write('Rendered {} {} {} fields'.format(count, model._meta.verbose_name, field))
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from goalzero.registration import backfill_serial_keys, check_serials_csv
+
+
+class Command(BaseCommand):
+	help = 'Check a CSV of serial numbers against registered products, writing a status for each'
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help='CSV file to read, or - for stdin')
+		parser.add_argument('--column', type=int, default=0, help='Zero based column holding the serial number')
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--backfill', action='store_true', help='Create normalized keys for registrations saved without one first')
+
+	def handle(self, *args, **options):
+		if options['backfill']:
+			updated = backfill_serial_keys()
+			self.stderr.write('Created {} serial number keys'.format(updated))
+
+		if options['path'] == '-':
+			check_serials_csv(sys.stdin, self.stdout, options['column'], options['batch_size'])
+		else:
+			with open(options['path'], newline='') as infile:
+				check_serials_csv(infile, self.stdout, options['column'], options['batch_size'])
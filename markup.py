@@ -0,0 +1,23 @@
+import hashlib
+import markdown
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import LRUCache
+
+_local = LRUCache(getattr(settings, 'MARKDOWN_CACHE_SIZE', 2048))
+
+
+def render_markdown(text, extensions=('extra',)):
+	"HTML for markdown `text`, cached by content hash in process and in the shared cache"
+	text = text or ''
+	key = 'goalzero:markdown:{}:{}'.format(','.join(extensions), hashlib.sha1(text.encode('utf-8')).hexdigest())
+	html = _local.get(key)
+	if html is None:
+		html = cache.get(key)
+		if html is None:
+			html = markdown.markdown(text, list(extensions))
+			cache.set(key, html, getattr(settings, 'MARKDOWN_CACHE_TTL', 60 * 60 * 24 * 30))
+		_local.set(key, html)
+	return html
@@ -1,5 +1,5 @@
-import markdown
 import re
+from datetime import datetime
 from jinja2 import escape
 from sortedm2m.fields import SortedManyToManyField
 from urllib.parse import urlparse
@@ -8,6 +8,7 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from django.core.urlresolvers import reverse
 
 from sideadmin.fields import ImageUploaderField
@@ -22,7 +23,10 @@ from sidetools.mantles.models import BaseMantle
 from sidepost.mixins import MarkdownMixin
 from storelocator.models import Location as StorelocatorLocation
 
+from .caching import VersionedValue
+from .markup import render_markdown
 from .mixins import AnchorMixin, TwoColumnLayoutMixin
+from .pages import AssembledPage
 
 
 class Mantle(BaseMantle):
@@ -80,29 +84,43 @@ class Member(BaseMember):
 	def search_queryset(cls):
 		return cls.objects.public()
 
-	def social_accounts(self):
+	_social_networks = None
+
+	@classmethod
+	def social_networks(cls):
+		"(name, slug, attribute) for each social network in display order, resolved once"
+		if cls._social_networks is None:
+			networks = sorted(Social.networks, key=lambda x: Social.networks[x]['sort'])
+			cls._social_networks = [(network, slugify(network), slugify(network).replace('-', '_')) for network in networks]
+		return cls._social_networks
+
+	def build_social_accounts(self):
 		accounts = []
-		networks = sorted(Social.networks, key=lambda x: Social.networks[x]['sort'])
-		for network in networks:
-			account = getattr(self, slugify(network).replace('-', '_'), None)
+		for network, slug, attribute in self.social_networks():
+			account = getattr(self, attribute, None)
 			if account:
 				accounts.append({
 					'name': network,
-					'slug': slugify(network),
+					'slug': slug,
 					'account': account,
 					'url': Social.url(network, account),
 				})
 		if self.website:
 			accounts.append({
 				'name': '',
-				'slug': slugify('Website'),
+				'slug': 'website',
 				'account': urlparse(self.website).netloc,
 				'url': self.website,
 			})
 		return accounts
 
+	def social_accounts(self):
+		if not hasattr(self, '_social_accounts'):
+			self._social_accounts = self.build_social_accounts()
+		return self._social_accounts
+
 	def html(self, filter=None, field_name=False):
-		return markdown.markdown(getattr(self, field_name, 'content') if field_name else self.content, ['extra'])
+		return render_markdown(getattr(self, field_name, 'content') if field_name else self.content)
 
 
 class FeaturedCategory(BaseImageBlock, Block):
@@ -249,13 +267,19 @@ class FeaturedPage(MetaModel, RelatableModel):
 			self.slug = slugify(self.name)
 		super(FeaturedPage, self).save(*args, **kwargs)
 
+	def assembled(self):
+		"Blocks, mantles and related products for rendering, loaded once per instance"
+		if not hasattr(self, '_assembled'):
+			self._assembled = AssembledPage(self)
+		return self._assembled
+
 	def get_menu_items(self):
 		if not self.generate_menu:
 			return []
 
-		menu_items = [{'url': '#{}'.format(block.anchor), 'name': block.menu_name} for block in self.related("blocks") if getattr(block, 'anchor', False)]
+		menu_items = [{'url': '#{}'.format(block.anchor), 'name': block.menu_name} for block in self.assembled()['blocks'] if getattr(block, 'anchor', False)]
 
-		if self.related('related_products'):
+		if self.assembled()['related_products']:
 			menu_items.append({'url': "#buy", 'name': 'Buy'})
 
 		return menu_items
@@ -295,7 +319,29 @@ class ChargeTimeBlock(Block, AnchorMixin):
 _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
 
 
-class ComparisonChartBlock(BaseImageBlock, Block, AnchorMixin):
+def _paragraphs(text):
+	return _paragraph_re.split(escape(text))
+
+
+def _paragraph_pairs(text):
+	iterator = iter(_paragraphs(text))
+	return list(zip(iterator, iterator))
+
+
+class CompiledContentMixin(object):
+	"Blocks whose text is split into escaped paragraphs once per instance, not on every accessor call"
+
+	def compiled(self):
+		if not hasattr(self, '_compiled'):
+			self._compiled = self.compile_content()
+		return self._compiled
+
+	def save(self, *args, **kwargs):
+		self.__dict__.pop('_compiled', None)
+		super(CompiledContentMixin, self).save(*args, **kwargs)
+
+
+class ComparisonChartBlock(CompiledContentMixin, BaseImageBlock, Block, AnchorMixin):
 	POSITION_CHOICES = (
 		(1, 'left'),
 		(2, 'center'),
@@ -323,22 +369,26 @@ class ComparisonChartBlock(BaseImageBlock, Block, AnchorMixin):
 	def url(self):
 		return self.url
 
+	def compile_content(self):
+		return {
+			'left': _paragraph_pairs(self.left_column_content),
+			'right': _paragraph_pairs(self.right_column_content),
+		}
+
 	def get_left_items(self):
-		iterator = iter(_paragraph_re.split(escape(self.left_column_content)))
 		return {
 			'name': self.left_column_title,
-			'compare_items': list(zip(iterator, iterator))
+			'compare_items': [tuple(pair) for pair in self.compiled()['left']]
 		}
 
 	def get_right_items(self):
-		iterator = iter(_paragraph_re.split(escape(self.right_column_content)))
 		return {
 			'name': self.right_column_title,
-			'compare_items': list(zip(iterator, iterator))
+			'compare_items': [tuple(pair) for pair in self.compiled()['right']]
 		}
 
 
-class SplitBlock(BaseImageBlock, Block, AnchorMixin):
+class SplitBlock(CompiledContentMixin, BaseImageBlock, Block, AnchorMixin):
 	DESCRIPTION_TYPES = (
 		(1, 'Plain Text'),
 		(2, 'Unordered List'),
@@ -359,8 +409,11 @@ class SplitBlock(BaseImageBlock, Block, AnchorMixin):
 	admin = 'goalzero.admin.SplitBlockAdmin'
 	template = 'goalzero/blocks/{}.jinja'
 
+	def compile_content(self):
+		return {'description': _paragraphs(self.description)}
+
 	def get_description_items(self):
-		return _paragraph_re.split(escape(self.description))
+		return self.compiled()['description']
 
 
 class FeaturedProductsBlock(Block):
@@ -386,6 +439,9 @@ class TextBlock(Block, MarkdownMixin):
 	admin = 'goalzero.admin.TextBlockAdmin'
 	template = 'goalzero/blocks/{}.jinja'
 
+	def html(self, filter=None, field_name=False):
+		return render_markdown(getattr(self, field_name, 'content') if field_name else self.content)
+
 	def thumb(self):
 		return ""
 
@@ -458,7 +514,7 @@ class FounderBlock(Block):
 		return ""
 
 	def html(self, filter=None, field_name=False):
-		return markdown.markdown(getattr(self, field_name, 'description') if field_name else self.description, ['extra'])
+		return render_markdown(getattr(self, field_name, 'description') if field_name else self.description)
 
 	def __str__(self):
 		return self.title
@@ -468,7 +524,85 @@ class CostcoRoadShow(StorelocatorLocation):
 	start_date = models.DateTimeField()
 	end_date = models.DateTimeField()
 
+	@classmethod
+	def calendar(cls):
+		return roadshow_calendar.get()
+
+
+class RoadShowCalendar(object):
+	"""
+	Physical roadshows bucketed by locality and by every month they run in, along with
+	the month and state choices the store finder offers. Rebuilt when a roadshow changes.
+	"""
+
+	def __init__(self, rows):
+		self.by_locality = {}
+		self.buckets = {}
+		self.states = []
+		months = set()
+		for pk, locality_id, locality_name, start_date, end_date in rows:
+			if locality_id not in self.by_locality:
+				self.by_locality[locality_id] = []
+				self.states.append((locality_name, locality_id))
+			self.by_locality[locality_id].append(pk)
+			for month in self.months_between(start_date, end_date):
+				self.buckets.setdefault((locality_id, month), []).append(pk)
+				months.add(month)
+		self.months = [datetime(year=year, month=month, day=1) for year, month in sorted(months)]
+
+	@classmethod
+	def build(cls):
+		rows = CostcoRoadShow.objects.exclude(online=True).order_by('locality', 'start_date')
+		return cls(rows.values_list('pk', 'locality__id', 'locality__name', 'start_date', 'end_date'))
+
+	@staticmethod
+	def months_between(start_date, end_date):
+		"Every (year, month) from `start_date` through `end_date`"
+		if timezone.is_aware(start_date):
+			start_date, end_date = timezone.localtime(start_date), timezone.localtime(end_date)
+		year, month = start_date.year, start_date.month
+		while (year, month) <= (end_date.year, end_date.month):
+			yield year, month
+			year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+	def lookup(self, locality, date=None):
+		"Ids of the roadshows in `locality`, limited to those running during the month of `date`"
+		if date:
+			return self.buckets.get((locality, (date.year, date.month)), [])
+		return self.by_locality.get(locality, [])
+
+
+roadshow_calendar = VersionedValue('roadshows:calendar', RoadShowCalendar.build)
+
+
+_serial_re = re.compile(r'[^0-9A-Z]+')
+
 
 class RegistrationProduct(BaseProduct):
 	registration = models.ForeignKey('registration.Registration', related_name="registration_product")
 	serial_number = models.CharField(max_length=200, blank=True)
+
+	@staticmethod
+	def normalize_serial(serial):
+		"Uppercase and drop spaces, dashes and other separators so typing variations match"
+		return _serial_re.sub('', (serial or '').upper())
+
+	def save(self, *args, **kwargs):
+		super(RegistrationProduct, self).save(*args, **kwargs)
+		self.save_serial_key()
+
+	def save_serial_key(self):
+		key = self.normalize_serial(self.serial_number)
+		if key:
+			RegistrationSerial.objects.update_or_create(product_id=self.pk, defaults={'key': key})
+		else:
+			RegistrationSerial.objects.filter(product_id=self.pk).delete()
+
+
+class RegistrationSerial(models.Model):
+	"Normalized serial number of a RegistrationProduct, indexed for duplicate checks"
+	product = models.OneToOneField(RegistrationProduct, related_name='serial_key')
+	key = models.CharField(max_length=200, db_index=True)
+
+
+from . import signals  # noqa: connect cache invalidation receivers
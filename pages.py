@@ -0,0 +1,140 @@
+import collections
+import hashlib
+
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericRelation
+from django.core.cache import cache
+from django.db.models.query import prefetch_related_objects
+from django.template.loader import render_to_string
+
+from sidepost.models import Page
+
+from .caching import LRUCache, VersionStamp
+
+pages_version = VersionStamp('pages')
+_local = LRUCache(getattr(settings, 'PAGE_CACHE_SIZE', 256))
+
+block_hits = collections.Counter()
+block_misses = collections.Counter()
+
+
+def get_page(slug, public=False, related=()):
+	"""
+	The Page with `slug` (only if public, when asked), with `related(name)` for each of
+	`related` already evaluated into `page.hydrated[name]`. Pages are kept per process and
+	in the shared cache under the pages version stamp, which moves on every content save.
+	Raises Page.DoesNotExist like a normal lookup.
+	"""
+	key = 'goalzero:page:{}:{}:{}:{}'.format(pages_version.version(), slug, int(public), ','.join(related))
+	page = _local.get(key)
+	if page is None:
+		page = cache.get(key)
+		if page is None:
+			page = (Page.objects.public() if public else Page.objects).get(slug=slug)
+			page.hydrated = {name: list(page.related(name)) for name in related}
+			cache.set(key, page, getattr(settings, 'PAGE_CACHE_TTL', 60 * 5))
+		_local.set(key, page, getattr(settings, 'PAGE_CACHE_TTL', 60 * 5))
+	return page
+
+
+def block_lookups(model):
+	"GenericRelations and forward many-to-many fields of a block model, for prefetch_related"
+	return [field.name for field in model._meta.get_fields() if isinstance(field, GenericRelation) or (field.many_to_many and not field.auto_created)]
+
+
+def reverse_lookups(model):
+	"Accessors of foreign keys declared against `model` itself (e.g. ProductFeature.block), for prefetch_related"
+	return [field.get_accessor_name() for field in model._meta.get_fields() if field.one_to_many and field.auto_created and field.field.related_model is model]
+
+
+def prefetch_blocks(blocks):
+	"""
+	Prefetch each block type's own relations onto `blocks` in place, with one query per
+	relation per concrete type. The blocks themselves are not loaded again.
+	"""
+	by_type = collections.OrderedDict()
+	for block in blocks:
+		by_type.setdefault(type(block), []).append(block)
+	for model, instances in by_type.items():
+		lookups = block_lookups(model) + reverse_lookups(model)
+		if lookups:
+			prefetch_related_objects(instances, lookups)
+	return blocks
+
+
+def _field_values(instance):
+	return repr([getattr(instance, field.attname) for field in instance._meta.concrete_fields])
+
+
+def block_version(block):
+	"Digest of a block's own fields and of the related objects and reverse foreign key rows prefetched for it"
+	digest = hashlib.md5(_field_values(block).encode('utf-8'))
+	for name, related in sorted(getattr(block, '_prefetched_objects_cache', {}).items()):
+		for instance in related:
+			digest.update('{}:{}'.format(name, _field_values(instance)).encode('utf-8'))
+	return digest.hexdigest()
+
+
+def block_key(block):
+	return 'goalzero:block:{}:{}:{}'.format(block._meta.model_name, block.pk, block_version(block))
+
+
+# Blocks showing products carry prices, stock and per-request markup, so they are never shared
+UNCACHED_BLOCKS = getattr(settings, 'BLOCK_CACHE_EXCLUDE', ('chargetimeblock', 'featuredproductsblock', 'productlineblock'))
+
+
+def cacheable(block):
+	"Whether `block` can be shared between visitors; blocks setting `render_per_request` (forms, user state) cannot"
+	return block._meta.model_name not in UNCACHED_BLOCKS and not getattr(block, 'render_per_request', False)
+
+
+def render_block(block, request=None):
+	return render_to_string(block.template.format(block._meta.model_name), {'block': block}, request=request)
+
+
+def render_blocks(blocks, request=None):
+	"""
+	HTML for each block, fetched from the cache with a single multi-get and rendered only
+	for misses. Keys include a digest of the block and its prefetched relations, so editing
+	a block, its images, videos or features retires the fragment without explicit invalidation.
+	Shared fragments are rendered without `request`, so no CSRF token or per-user context is
+	baked into them; blocks that are not `cacheable` are rendered with it for every request.
+	"""
+	keys = [block_key(block) if cacheable(block) else None for block in blocks]
+	fragments = cache.get_many([key for key in keys if key])
+	fresh = {}
+	rendered = []
+	for block, key in zip(blocks, keys):
+		stat = (block._meta.model_name, block.pk)
+		html = fragments.get(key) if key else None
+		if html is None:
+			block_misses[stat] += 1
+			html = render_block(block, None if key else request)
+			if key:
+				fresh[key] = html
+		else:
+			block_hits[stat] += 1
+		rendered.append(html)
+	if fresh:
+		cache.set_many(fresh, getattr(settings, 'BLOCK_CACHE_TTL', 60 * 60 * 24))
+	return rendered
+
+
+class AssembledPage(object):
+	"A page's related() lists, each evaluated once on first use, with block relations prefetched by type"
+
+	def __init__(self, page):
+		self.page = page
+		self.related = {}
+
+	def __getitem__(self, name):
+		if name not in self.related:
+			related = list(self.page.related(name))
+			self.related[name] = prefetch_blocks(related) if name == 'blocks' else related
+		return self.related[name]
+
+	def rendered_blocks(self, request=None):
+		"(block, html) pairs, the HTML coming from the block fragment cache"
+		if not hasattr(self, '_rendered_blocks'):
+			self._rendered_blocks = list(zip(self['blocks'], render_blocks(self['blocks'], request)))
+		return self._rendered_blocks
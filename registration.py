@@ -0,0 +1,278 @@
+import csv
+import hashlib
+import json
+import math
+import re
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Q
+
+from .caching import VersionedValue
+from .models import RegistrationProduct, RegistrationSerial
+
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+REGISTERED = 'registered'
+AVAILABLE = 'available'
+
+
+class BloomFilter(object):
+	"Fixed size set membership test that can answer false positives but never false negatives"
+
+	def __init__(self, capacity, error_rate=0.01):
+		capacity = max(capacity, 1)
+		self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+
+	def positions(self, key):
+		digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+		a, b = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+		return ((a + i * b) % self.size for i in range(self.hashes))
+
+	def add(self, key):
+		for position in self.positions(key):
+			self.bits[position >> 3] |= 1 << (position & 7)
+
+	def __contains__(self, key):
+		return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class SerialIndex(object):
+	"""
+	Bloom filter over every registered serial number, built from the table up to `max_pk`
+	and sized for `count` rows plus headroom. Rows inserted after that are folded in before
+	each lookup, so only keys the filter may contain are ever looked up in the table; once
+	they outgrow the headroom the index is invalidated and rebuilt at the new size.
+	"""
+
+	def __init__(self, serials, count, max_pk, error_rate=None):
+		self.max_pk = max_pk or 0
+		self.count = 0
+		self.capacity = count + max(count // 4, 1000)
+		self.bloom = BloomFilter(self.capacity, error_rate or getattr(settings, 'REGISTRATION_SERIAL_BLOOM_ERROR_RATE', 0.01))
+		for serial in serials:
+			self.add(serial)
+		self._lock = threading.Lock()
+
+	@classmethod
+	def build(cls):
+		max_pk = RegistrationProduct.objects.aggregate(max_pk=Max('pk'))['max_pk']
+		serials = RegistrationProduct.objects.filter(pk__lte=max_pk or 0).exclude(serial_number='').values_list('serial_number', flat=True)
+		return cls(serials.iterator(), serials.count(), max_pk)
+
+	def add(self, serial):
+		self.bloom.add(RegistrationProduct.normalize_serial(serial))
+		self.count += 1
+
+	def extend(self):
+		"Add rows inserted since the filter was built or last extended"
+		with self._lock:
+			rows = RegistrationProduct.objects.filter(pk__gt=self.max_pk).order_by('pk').values_list('pk', 'serial_number')
+			for pk, serial in rows.iterator():
+				self.max_pk = pk
+				if serial:
+					self.add(serial)
+
+	def registered(self, keys):
+		"The subset of normalized `keys` already registered; keys the filter rules out never reach the table"
+		self.extend()
+		if self.count > self.capacity:
+			# Past capacity the false positive rate climbs; this answer is still exact
+			serial_index.invalidate()
+		maybe = {key for key in keys if key in self.bloom}
+		if not maybe:
+			return set()
+		# Raw serials match too, for rows whose normalized key has not been backfilled yet
+		rows = RegistrationProduct.objects.filter(Q(serial_key__key__in=maybe) | Q(serial_number__in=maybe))
+		return {RegistrationProduct.normalize_serial(serial) for serial in rows.values_list('serial_number', flat=True)} & maybe
+
+
+serial_index = VersionedValue('registration:serials', SerialIndex.build)
+
+_pattern = None
+
+
+def valid_serial(key):
+	global _pattern
+	if _pattern is None:
+		_pattern = re.compile(getattr(settings, 'REGISTRATION_SERIAL_PATTERN', r'^[0-9A-Z]{6,40}$'))
+	return bool(_pattern.match(key))
+
+
+def check_serials(serials, seen=None):
+	"""
+	Return (serial, normalized key, status) for each serial, status being one of the module
+	constants. Pass the same `seen` set across batches to catch repeats between them.
+	"""
+	keyed = [(serial, RegistrationProduct.normalize_serial(serial)) for serial in serials]
+	registered = serial_index.get().registered(key for serial, key in keyed if valid_serial(key))
+
+	results = []
+	seen = set() if seen is None else seen
+	for serial, key in keyed:
+		if not valid_serial(key):
+			status = INVALID
+		elif key in registered:
+			status = REGISTERED
+		elif key in seen:
+			status = DUPLICATE
+		else:
+			status = AVAILABLE
+		seen.add(key)
+		results.append((serial, key, status))
+	return results
+
+
+def check_serials_csv(infile, outfile, column=0, batch_size=1000):
+	"Check the serials in `column` of a CSV, writing serial, key and status rows to `outfile`"
+	writer = csv.writer(outfile)
+	writer.writerow(('serial_number', 'key', 'status'))
+	batch = []
+	seen = set()
+	for row in csv.reader(infile):
+		if len(row) > column:
+			batch.append(row[column])
+		if len(batch) >= batch_size:
+			writer.writerows(check_serials(batch, seen))
+			batch = []
+	if batch:
+		writer.writerows(check_serials(batch, seen))
+
+
+def backfill_serial_keys(batch_size=1000):
+	"Create the RegistrationSerial of every product saved without one, returning how many were created"
+	created = 0
+	batch = []
+	rows = RegistrationProduct.objects.filter(serial_key=None).exclude(serial_number='')
+	for pk, serial in rows.values_list('pk', 'serial_number').iterator():
+		key = RegistrationProduct.normalize_serial(serial)
+		if key:
+			batch.append(RegistrationSerial(product_id=pk, key=key))
+		if len(batch) >= batch_size:
+			RegistrationSerial.objects.bulk_create(batch)
+			created += len(batch)
+			batch = []
+	if batch:
+		RegistrationSerial.objects.bulk_create(batch)
+		created += len(batch)
+	return created
+
+
+EXPORT_MODELS = {
+	'registration': 'registration.Registration',
+	'product': 'goalzero.RegistrationProduct',
+}
+
+
+def export_model(name):
+	"Model exported under `name`, or None"
+	label = EXPORT_MODELS.get(name)
+	return apps.get_model(label) if label else None
+
+
+def export_fields(model):
+	return [field.attname for field in model._meta.concrete_fields]
+
+
+def iter_chunks(model, chunk_size=2000):
+	"Every row of `model` as value tuples, one primary key ordered chunk at a time"
+	fields = export_fields(model)
+	pk_index = fields.index(model._meta.pk.attname)
+	queryset = model._default_manager.order_by('pk').values_list(*fields)
+	rows = list(queryset[:chunk_size])
+	while rows:
+		yield rows
+		rows = list(queryset.filter(pk__gt=rows[-1][pk_index])[:chunk_size])
+
+
+class _Echo(object):
+	"File-like object whose write() hands the line back, so csv.writer can feed a generator"
+
+	def write(self, value):
+		return value
+
+
+def export_csv(model, chunk_size=2000):
+	writer = csv.writer(_Echo())
+	yield writer.writerow(export_fields(model))
+	for rows in iter_chunks(model, chunk_size):
+		yield ''.join(writer.writerow(row) for row in rows)
+
+
+def export_ndjson(model, chunk_size=2000):
+	fields = export_fields(model)
+	for rows in iter_chunks(model, chunk_size):
+		yield ''.join(json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+
+EXPORT_FORMATS = {
+	'csv': (export_csv, 'text/csv'),
+	'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
+
+
+def read_rows(infile, format='csv'):
+	"Dicts of field name -> value from a CSV (with header) or NDJSON export"
+	if format == 'ndjson':
+		return (json.loads(line) for line in infile if line.strip())
+	return csv.DictReader(infile)
+
+
+def check_references(model, batch):
+	"Raise ValueError when a foreign key in `batch` points at a row that does not exist"
+	for field in model._meta.concrete_fields:
+		if field.is_relation and field.many_to_one:
+			values = {field.to_python(getattr(instance, field.attname)) for instance in batch} - {None}
+			found = set(field.related_model._default_manager.filter(pk__in=values).values_list('pk', flat=True))
+			if values - found:
+				raise ValueError('{} values not found: {}'.format(field.attname, ', '.join(str(value) for value in sorted(values - found)[:10])))
+
+
+def import_rows(model, rows, batch_size=1000, keep_ids=False, progress=None):
+	"""
+	Create `model` rows from field name -> value dicts with bulk inserts of `batch_size`,
+	calling `progress(count)` after each batch. Returns the number of rows created. The
+	import is one transaction, refused with ValueError if any foreign key points nowhere
+	(e.g. products whose registrations were imported under new ids).
+	"""
+	fields = {field.attname: field for field in model._meta.concrete_fields}
+	if not keep_ids:
+		fields.pop(model._meta.pk.attname)
+
+	def create(batch):
+		check_references(model, batch)
+		model._default_manager.bulk_create(batch)
+
+	count = 0
+	batch = []
+	with transaction.atomic():
+		for row in rows:
+			values = {}
+			for name, value in row.items():
+				field = fields.get(name)
+				if field is not None:
+					values[name] = None if value == '' and field.null else value
+			batch.append(model(**values))
+			if len(batch) >= batch_size:
+				create(batch)
+				count += len(batch)
+				batch = []
+				if progress:
+					progress(count)
+		if batch:
+			create(batch)
+			count += len(batch)
+			if progress:
+				progress(count)
+
+		# bulk_create skips save(), so imported products get their serial keys here
+		if model is RegistrationProduct:
+			backfill_serial_keys(batch_size)
+	if model is RegistrationProduct:
+		serial_index.invalidate()
+	return count
@@ -0,0 +1,152 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from sideadmin.models import Block, Image
+from sidecart.orders.signals import cart_change
+from sidecart.products.models import Category, Product, Variation
+from sidepost.models import Page, Post, Category as PostCategory
+from sidetools.mantles.models import BaseMantle
+from storelocator.models import Location, Category as LocatorCategory
+
+from .blog import blog_taxonomy, post_slugs, posts_version, story_timeline
+from .cart import forget_cart_summary
+from .catalog import landing_product_ids, registration_catalog, update_media_manifest
+from .locator import category_slugs, fragment_key, inventory_index, inventory_models, product_slugs, store_index
+from .models import CostcoRoadShow, Member, RegistrationProduct, roadshow_calendar
+from .pages import pages_version
+from .registration import serial_index
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def location_changed(sender, instance, **kwargs):
+	if isinstance(instance, Location):
+		store_index.invalidate()
+		cache.delete(fragment_key(instance.pk))
+
+
+@receiver(post_save, sender=LocatorCategory)
+@receiver(post_delete, sender=LocatorCategory)
+def locator_category_changed(sender, **kwargs):
+	category_slugs.invalidate()
+
+
+@receiver(m2m_changed, sender=Location.categories.through)
+def location_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if action.startswith('post_'):
+		store_index.invalidate()
+		pks = (pk_set or ()) if reverse else (instance.pk,)
+		cache.delete_many([fragment_key(pk) for pk in pks])
+
+
+_inventory_models = None
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def inventory_changed(sender, **kwargs):
+	global _inventory_models
+	if _inventory_models is None:
+		_inventory_models = inventory_models()
+	if sender in _inventory_models:
+		inventory_index.invalidate()
+
+
+@receiver(post_save, sender=CostcoRoadShow)
+@receiver(post_delete, sender=CostcoRoadShow)
+def roadshow_changed(sender, **kwargs):
+	roadshow_calendar.invalidate()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+	landing_product_ids.invalidate()
+	registration_catalog.invalidate()
+	product_slugs.invalidate()
+	update_media_manifest(instance, deleted=kwargs.get('signal') is post_delete)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, action, **kwargs):
+	if action.startswith('post_'):
+		landing_product_ids.invalidate()
+		registration_catalog.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def product_category_changed(sender, **kwargs):
+	# Both are keyed on the shop categories and their names
+	landing_product_ids.invalidate()
+	registration_catalog.invalidate()
+
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def variation_changed(sender, **kwargs):
+	registration_catalog.invalidate()
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def image_changed(sender, instance, **kwargs):
+	if isinstance(getattr(instance, 'content_object', None), Product):
+		update_media_manifest(instance.content_object)
+
+
+@receiver(post_save, sender=RegistrationProduct)
+def registration_product_changed(sender, created, **kwargs):
+	# New rows are always rechecked against the table; only edits can hide a serial
+	if not created:
+		serial_index.invalidate()
+
+
+@receiver(cart_change)
+def cart_changed(sender, request=None, **kwargs):
+	if request is not None:
+		forget_cart_summary(request)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, **kwargs):
+	posts_version.invalidate()
+	blog_taxonomy.invalidate()
+	post_slugs.invalidate()
+	story_timeline.invalidate()
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def post_categories_changed(sender, action, **kwargs):
+	if action.startswith('post_'):
+		posts_version.invalidate()
+		blog_taxonomy.invalidate()
+		story_timeline.invalidate()
+
+
+@receiver(post_save, sender=PostCategory)
+@receiver(post_delete, sender=PostCategory)
+def post_category_changed(sender, **kwargs):
+	blog_taxonomy.invalidate()
+	story_timeline.invalidate()
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def member_changed(sender, **kwargs):
+	story_timeline.invalidate()
+
+
+@receiver(m2m_changed, sender=Member.categories.through)
+def member_categories_changed(sender, action, **kwargs):
+	if action.startswith('post_'):
+		story_timeline.invalidate()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def page_content_changed(sender, instance, **kwargs):
+	if isinstance(instance, (Page, BaseMantle, Block)):
+		pages_version.invalidate()
@@ -0,0 +1,335 @@
+import collections
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
+from geopy.exc import GeocoderQuotaExceeded, GeocoderTimedOut
+
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.test import SimpleTestCase, override_settings
+
+from goalzero.blog import decode_cursor, encode_cursor, keyset_order, keyset_page
+from goalzero.cart import SUMMARY_SESSION_KEY, cart_delta, cart_summary
+from goalzero.geocoding import GeocodeCache, normalize_query
+from goalzero.registration import AVAILABLE, DUPLICATE, INVALID, REGISTERED, BloomFilter, SerialIndex, check_serials
+
+FakeLocation = collections.namedtuple('FakeLocation', ('address', 'latitude', 'longitude'))
+
+
+class FakeGeocoder(object):
+	"Stands in for GoogleV3: answers from `results`, optionally sleeping `delays[query]` or until `release` is set"
+
+	def __init__(self, results=None, delays=None, release=None, errors=None):
+		self.results = results or {}
+		self.delays = delays or {}
+		self.release = release
+		self.errors = list(errors or ())
+		self.calls = []
+		self._lock = threading.Lock()
+
+	def geocode(self, query):
+		with self._lock:
+			self.calls.append(query)
+		if self.release is not None:
+			self.release.wait(5)
+		time.sleep(self.delays.get(query, 0))
+		if self.errors:
+			raise self.errors.pop(0)
+		return self.results.get(normalize_query(query))
+
+
+SALT_LAKE = FakeLocation('Salt Lake City, UT, USA', 40.7608, -111.891)
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'goalzero-geocoding-tests'}}
+
+
+def wait_for(condition, timeout=2):
+	deadline = time.monotonic() + timeout
+	while not condition() and time.monotonic() < deadline:
+		time.sleep(0.005)
+	return condition()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GeocodeCacheTests(SimpleTestCase):
+
+	def setUp(self):
+		caches['default'].clear()
+
+	def geocode_cache(self, geocoder, **kwargs):
+		return GeocodeCache(geocoder=geocoder, backend='default', **kwargs)
+
+	def test_equivalent_queries_share_an_entry(self):
+		geocoder = FakeGeocoder({'salt lake city ut': SALT_LAKE})
+		geocode_cache = self.geocode_cache(geocoder)
+		self.assertEqual(geocode_cache.geocode('Salt Lake City, UT').address, SALT_LAKE.address)
+		self.assertEqual(geocode_cache.geocode('  salt lake city   ut ').address, SALT_LAKE.address)
+		self.assertEqual(len(geocoder.calls), 1)
+		self.assertEqual(geocode_cache.stats['local_hits'], 1)
+
+	def test_shared_cache_answers_other_processes(self):
+		self.geocode_cache(FakeGeocoder({'84101': SALT_LAKE})).geocode('84101')
+		geocoder = FakeGeocoder()
+		geocode_cache = self.geocode_cache(geocoder)
+		self.assertEqual(geocode_cache.geocode('84101').latitude, SALT_LAKE.latitude)
+		self.assertEqual(geocoder.calls, [])
+		self.assertEqual(geocode_cache.stats['shared_hits'], 1)
+
+	def test_not_found_is_cached(self):
+		geocoder = FakeGeocoder()
+		geocode_cache = self.geocode_cache(geocoder, negative_ttl=60)
+		self.assertIsNone(geocode_cache.geocode('nowhere at all'))
+		self.assertIsNone(geocode_cache.geocode('Nowhere, at all'))
+		self.assertEqual(len(geocoder.calls), 1)
+		self.assertEqual(geocode_cache.stats['not_found'], 2)
+		self.assertEqual(caches['default'].get(geocode_cache.key('nowhere at all')), ())
+
+	def test_errors_are_not_cached(self):
+		geocoder = FakeGeocoder({'84101': SALT_LAKE}, errors=[GeocoderQuotaExceeded('Over quota')])
+		geocode_cache = self.geocode_cache(geocoder)
+		with self.assertRaises(GeocoderQuotaExceeded):
+			geocode_cache.geocode('84101')
+		self.assertEqual(geocode_cache.geocode('84101').address, SALT_LAKE.address)
+		self.assertEqual(len(geocoder.calls), 2)
+
+	def test_concurrent_lookups_are_coalesced(self):
+		release = threading.Event()
+		geocoder = FakeGeocoder({'84101': SALT_LAKE}, release=release)
+		geocode_cache = self.geocode_cache(geocoder, timeout=5)
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(geocode_cache.geocode('84101'))) for i in range(5)]
+		for thread in threads:
+			thread.start()
+		self.assertTrue(wait_for(lambda: geocode_cache.stats['coalesced'] == 4))
+		release.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(len(geocoder.calls), 1)
+		self.assertEqual([result.address for result in results], [SALT_LAKE.address] * 5)
+
+	def test_timeout_raises_and_keeps_the_late_answer(self):
+		release = threading.Event()
+		geocoder = FakeGeocoder({'84101': SALT_LAKE}, release=release)
+		geocode_cache = self.geocode_cache(geocoder, timeout=0.1)
+		with self.assertRaises(GeocoderTimedOut):
+			geocode_cache.geocode('84101')
+		self.assertEqual(geocode_cache.stats['timeouts'], 1)
+
+		release.set()
+		self.assertTrue(wait_for(lambda: not geocode_cache._inflight))
+		self.assertEqual(geocode_cache.geocode('84101').address, SALT_LAKE.address)
+		self.assertEqual(len(geocoder.calls), 1)
+
+	def test_timeout_includes_waiting_for_a_slot(self):
+		geocoder = FakeGeocoder({'84101': SALT_LAKE}, delays={'84101': 0.2, 'salt lake city': 2})
+		geocode_cache = self.geocode_cache(geocoder, timeout=0.4, concurrency=1)
+		first = threading.Thread(target=geocode_cache.geocode, args=('84101',))
+		first.start()
+		self.assertTrue(wait_for(lambda: geocoder.calls))
+
+		started = time.monotonic()
+		with self.assertRaises(GeocoderTimedOut):
+			geocode_cache.geocode('salt lake city')
+		self.assertLess(time.monotonic() - started, 0.55)
+		first.join()
+
+	def test_outstanding_calls_are_capped(self):
+		release = threading.Event()
+		geocoder = FakeGeocoder(release=release)
+		geocode_cache = self.geocode_cache(geocoder, timeout=5, concurrency=2)
+		threads = [threading.Thread(target=geocode_cache.geocode, args=(query,)) for query in ('84101', '84102')]
+		for thread in threads:
+			thread.start()
+		self.assertTrue(wait_for(lambda: len(geocoder.calls) == 2))
+
+		geocode_cache.timeout = 0.1
+		with self.assertRaises(GeocoderTimedOut):
+			geocode_cache.geocode('84103')
+		self.assertEqual(len(geocoder.calls), 2)
+		release.set()
+		for thread in threads:
+			thread.join()
+
+
+FakePost = collections.namedtuple('FakePost', ('pk', 'publish_date'))
+
+
+def matches(obj, q):
+	"Evaluate a Q of exact, lt and gt lookups against `obj`"
+	results = [matches(obj, child) if isinstance(child, Q) else lookup(obj, *child) for child in q.children]
+	result = any(results) if q.connector == Q.OR else all(results)
+	return not result if q.negated else result
+
+
+def lookup(obj, name, value):
+	field, _, op = name.partition('__')
+	actual = getattr(obj, field)
+	if isinstance(actual, datetime) and isinstance(value, str):
+		actual = actual.isoformat()
+	return {'': actual == value, 'lt': actual < value, 'gt': actual > value}[op]
+
+
+class FakePosts(object):
+	"Just enough of a QuerySet for keyset_page: Q filters, order_by and slicing over a list"
+
+	def __init__(self, posts):
+		self.posts = list(posts)
+
+	def filter(self, q):
+		return FakePosts(post for post in self.posts if matches(post, q))
+
+	def order_by(self, *fields):
+		posts = list(self.posts)
+		for field in reversed(fields):
+			posts.sort(key=lambda post: getattr(post, field.lstrip('-')), reverse=field.startswith('-'))
+		return FakePosts(posts)
+
+	def __getitem__(self, index):
+		return self.posts[index]
+
+
+class BlogCursorTests(SimpleTestCase):
+	order = '-publish_date'
+
+	def setUp(self):
+		# Several posts share a publish date, across page boundaries
+		dates = [datetime(2016, 5, day) for day in (9, 9, 9, 8, 8, 7, 7, 7, 6)]
+		self.posts = FakePosts(FakePost(pk, date) for pk, date in enumerate(dates, 1)).order_by(*keyset_order(self.order))
+
+	def test_cursor_round_trip(self):
+		post = self.posts[2]
+		self.assertEqual(decode_cursor(encode_cursor(post, self.order, 3)), (post.publish_date.isoformat(), post.pk, 3))
+
+	def test_bad_cursors_are_ignored(self):
+		cursor = encode_cursor(self.posts[0], self.order, 2)
+		self.assertIsNone(decode_cursor(''))
+		self.assertIsNone(decode_cursor(cursor[:-2] + 'xx'))
+		self.assertIsNone(decode_cursor('not a cursor'))
+
+	def test_cursor_pages_continue_the_offset_order(self):
+		paginator = Paginator(self.posts.posts, 2)
+		page = paginator.page(1)
+		walked = list(page.object_list)
+		cursor = encode_cursor(page.object_list[-1], self.order, 2)
+		while cursor:
+			page = keyset_page(self.posts, self.order, decode_cursor(cursor), paginator)
+			self.assertEqual(page.start_index(), len(walked) + 1)
+			self.assertTrue(page.has_previous())
+			walked += page.object_list
+			cursor = page.next_cursor
+		self.assertEqual(walked, self.posts.posts)
+		self.assertEqual(page.number, paginator.num_pages)
+		self.assertFalse(page.has_next())
+
+
+class FakeSerialIndex(object):
+	"Answers registered() from a fixed set of keys, recording what it was asked"
+
+	def __init__(self, keys):
+		self.keys = set(keys)
+		self.asked = []
+
+	def get(self):
+		return self
+
+	def registered(self, keys):
+		keys = set(keys)
+		self.asked.append(keys)
+		return keys & self.keys
+
+
+class SerialCheckTests(SimpleTestCase):
+
+	def test_bloom_filter_has_no_false_negatives(self):
+		bloom = BloomFilter(1000)
+		keys = ['GZ{:08d}'.format(i) for i in range(1000)]
+		for key in keys:
+			bloom.add(key)
+		self.assertTrue(all(key in bloom for key in keys))
+
+	def test_bloom_filter_false_positive_rate(self):
+		bloom = BloomFilter(1000, error_rate=0.01)
+		for i in range(1000):
+			bloom.add('GZ{:08d}'.format(i))
+		false_positives = sum('XX{:08d}'.format(i) in bloom for i in range(10000))
+		self.assertLess(false_positives, 300)
+
+	def test_serial_index_leaves_headroom(self):
+		index = SerialIndex(iter(['gz-0001', 'GZ 0002']), 2, 2)
+		self.assertEqual(index.count, 2)
+		self.assertGreater(index.capacity, index.count)
+		self.assertIn('GZ0001', index.bloom)
+		self.assertIn('GZ0002', index.bloom)
+
+	def test_statuses(self):
+		index = FakeSerialIndex(['GZ123456'])
+		with mock.patch('goalzero.registration.serial_index', index):
+			results = check_serials(['gz-123456', 'GZ654321', 'gz 654 321', 'bad'])
+		self.assertEqual(results, [
+			('gz-123456', 'GZ123456', REGISTERED),
+			('GZ654321', 'GZ654321', AVAILABLE),
+			('gz 654 321', 'GZ654321', DUPLICATE),
+			('bad', 'BAD', INVALID),
+		])
+		self.assertEqual(index.asked, [{'GZ123456', 'GZ654321'}])
+
+	def test_seen_carries_across_batches(self):
+		seen = set()
+		with mock.patch('goalzero.registration.serial_index', FakeSerialIndex(())):
+			check_serials(['GZ654321'], seen)
+			results = check_serials(['GZ-654321'], seen)
+		self.assertEqual(results, [('GZ-654321', 'GZ654321', DUPLICATE)])
+
+
+FakeLine = collections.namedtuple('FakeLine', ('pk', 'item_id', 'price', 'quantity'))
+
+
+class FakeCart(object):
+	"A cart whose lines are `lines`, with previous_items recorded the way add_lines does"
+	pk = 1
+
+	def __init__(self, lines):
+		self.lines = list(lines)
+		self.items = self
+		self.previous_items = list(self.lines)
+
+	def all(self):
+		return self.lines
+
+
+class FakeRequest(object):
+
+	def __init__(self, cart):
+		self.cart = cart
+		self.session = {}
+
+
+class CartDeltaTests(SimpleTestCase):
+
+	def setUp(self):
+		self.request = FakeRequest(FakeCart([FakeLine(1, 10, Decimal('5.00'), 1)]))
+		self.summary = cart_summary(self.request)
+
+	def delta(self, *added_items):
+		return cart_delta(self.request, self.summary, list(added_items))
+
+	def test_new_and_updated_lines(self):
+		delta = self.delta(FakeLine(1, 10, Decimal('5.00'), 2), FakeLine(2, 20, Decimal('3.00'), 1))
+		self.assertEqual((delta['lines'], delta['count'], delta['subtotal']), (2, 3, '13.00'))
+		self.assertEqual([(line['id'], line['quantity'], line['change'], line['total']) for line in delta['added']], [
+			(1, 2, 1, '10.00'),
+			(2, 1, 1, '3.00'),
+		])
+		self.assertEqual(self.request.session[SUMMARY_SESSION_KEY], {'cart': 1, 'lines': 2, 'count': 3, 'subtotal': '13.00'})
+
+	def test_repeated_essential_counts_once(self):
+		delta = self.delta(FakeLine(1, 10, Decimal('5.00'), 2), FakeLine(2, 20, Decimal('3.00'), 1), FakeLine(2, 20, Decimal('3.00'), 2))
+		self.assertEqual((delta['lines'], delta['count'], delta['subtotal']), (2, 4, '16.00'))
+		self.assertEqual([(line['id'], line['change']) for line in delta['added']], [(1, 1), (2, 2)])
+
+	def test_essential_overlapping_the_product(self):
+		delta = self.delta(FakeLine(1, 10, Decimal('5.00'), 2), FakeLine(1, 10, Decimal('5.00'), 3))
+		self.assertEqual((delta['lines'], delta['count'], delta['subtotal']), (1, 3, '15.00'))
+		self.assertEqual([(line['id'], line['quantity'], line['change']) for line in delta['added']], [(1, 3, 2)])
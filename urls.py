@@ -25,7 +25,9 @@ urlpatterns = patterns('goalzero.views',
 	url(r'^product-landing/$', 'product_landing', name='product_landing'),
 	url(r'^product-features/(?P<page_slug>[0-9a-z-]+)/$', 'product_features', name='product_features'),
 	url(r'^product-registration/$', 'registration_index_override', name='registration'),
+	url(r'^product-registration/export/$', 'registration_export', name='registration_export'),
 	url(r'^store-finder/$', 'storelocator_index', name='storelocator_index'),
+	url(r'^store-finder/clusters/(?P<zoom>\d{1,2})/(?P<x>\d{1,8})/(?P<y>\d{1,8})/$', 'storelocator_clusters', name='storelocator_clusters'),
 	url(r'^store-finder/(.+)/$', 'storelocator_url_resolver_override', name='storelocator_url_resolver_override'),
 	url(r'^story/$', 'story', name='story'),
 	url(r'^how-it-works/$', 'how_it_works', name='how_it_works'),
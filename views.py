@@ -1,39 +1,44 @@
-import collections
 import json
 import pytz
-from geopy.exc import GeocoderQuotaExceeded
-from geopy.geocoders import GoogleV3
+from geopy.exc import GeocoderQuotaExceeded, GeocoderTimedOut
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
 
-from django.contrib.messages import success, error
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.messages import success, error, warning
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import FieldError
-from django.db.models import Q
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.utils.translation import ugettext_lazy as _
 
 from sidecart.core.decorators import region_allows
 from sidecart.core.middleware import CartMiddleware
-from sidecart.products.models import Category, Product, Variation, Item
+from sidecart.products.models import Category, Variation
 from sidecart.registration.views import index as registration_index
 from sidepost.models import Page, Post, Category as PostCategory
 from sidepost.views.posts import detail as blog_detail, default_context as blog_default_context
 from sidecart.orders.views import cart
-from sidecart.orders.signals import cart_change
 from storelocator.models import Location, Category as LocatorCategory
 from storelocator.serializers import LocationSerializer
 
-from .models import FeaturedPage, Member, CostcoRoadShow
+from .blog import EXCLUDED_CATEGORIES, CachedCountPaginator, blog_taxonomy, decode_cursor, encode_cursor, keyset_order, keyset_page, post_slugs, story_timeline
+from .cart import add_lines, cart_delta, cart_summary
+from .catalog import attach_landing_products, media_manifest, registration_catalog
+from .geocoding import geocode
+from .locator import annotate, category_slugs, inventory_index, product_slugs, search_etag, store_fragments, store_index, stream_json
+from .models import FeaturedPage, CostcoRoadShow
+from .pages import get_page
+from .registration import DUPLICATE, EXPORT_FORMATS, REGISTERED, check_serials, export_model
 
 
 def contact(request):
 	"Contact form page"
 	try:
-		page = Page.objects.get(slug='contact')
+		page = get_page('contact')
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Contact page missing!')
 	context = {
@@ -56,29 +61,27 @@ def contact(request):
 
 def home(request):
 	try:
-		page = Page.objects.get(slug='home')
+		page = get_page('home', related=('mantle',))
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Home pages missing!')
 	context = {
 		'page': page,
-		'mantles': page.related('mantle')
+		'mantles': page.hydrated['mantle']
 	}
 	return TemplateResponse(request, 'goalzero/home.jinja', context)
 
 
 def product_landing(request):
 	try:
-		page = Page.objects.get(slug='product-landing')
+		page = get_page('product-landing', related=('mantle',))
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Product Landing pages missing!')
 
-	categories = Category.objects.filter(parent__slug='shop')
-	for category in categories:
-		category.prefetched_products = Product.objects.public().filter(categories=category)[:3]
+	categories = attach_landing_products(list(Category.objects.filter(parent__slug='shop')))
 
 	context = {
 		'page': page,
-		'mantles': page.related('mantle'),
+		'mantles': page.hydrated['mantle'],
 		'categories': categories
 	}
 	return TemplateResponse(request, 'goalzero/product_landing.jinja', context)
@@ -88,49 +91,25 @@ def product_landing(request):
 def add_to_cart_override(request):
 	if 'wishlist' in request.POST:
 		return cart.wishlist.add(request)
-	update = True
-	vars = None
-	variation = None
-
-	# Add to cart
-	added_items = []
+	lines = []
 
-	items_to_cart = [{'item_id': request.POST.get('item_id'), 'product_id': request.POST.get('product_id'), 'quantity': request.POST.get('quantity', 1)}]
-
-	items_to_cart += [{'item_id': essential[1]} for essential in filter(lambda item: item[0].startswith('essential'), request.POST.items())]
+	# The mini cart can ask for just what changed instead of a re-rendered cart
+	delta = request.is_ajax() and request.POST.get('response') == 'delta'
 
 	try:
-		for item in items_to_cart:
-
-			"Adding items to carts"
+		# The product itself, then any "essential" add-ons, which are always specific items
+		lines.append({
+			'variation_id': int(request.POST['product_id']) if request.POST.get('product_id') else None,
+			'item_id': int(request.POST['item_id']) if request.POST.get('item_id') else None,
+			'quantity': int(request.POST.get('quantity', 1)),
+		})
+		lines += [{'variation_id': None, 'item_id': int(value), 'quantity': 1} for key, value in request.POST.items() if key.startswith('essential') and value]
+		summary = cart_summary(request) if delta else None
 
-			quantity = int(item.get('quantity', 1))
-			item_id = int(item.get('item_id')) if item.get('item_id', None) else None
-			variation_id = int(item.get('product_id')) if item.get('product_id', None) else None
-			# Wishlist request instead of cart
+		added_items = add_lines(request, lines)
 
-			request.cart.previous_items = list(request.cart.items.all())
-
-			# Find product
-			try:
-				variation = Variation.objects.public().get(id=variation_id)
-			except Variation.DoesNotExist:
-				pass
-
-			# Find item
-			if variation:
-				if variation.has_items:
-					if not item_id:
-						raise AttributeError(_("Please select a size!"))
-					item = get_object_or_404(Item, id=item_id)
-				else:
-					item = variation.item_set.first()
-			else:
-				item = get_object_or_404(Item, id=item_id)
-
-			added_items.append(request.cart.add(item, quantity, update=update, vars=vars or {}))
-
-		cart_change.send(sender='cart.change', cart=request.cart, request=request)
+		if delta:
+			return HttpResponse(json.dumps(cart_delta(request, summary, added_items)), content_type='application/json')
 
 		success(request, _('Added to your {label}!').format(label=request.cart.CART_LABEL.lower()))
 		response = redirect('cart')
@@ -139,10 +118,14 @@ def add_to_cart_override(request):
 		if request.is_ajax():
 			CartMiddleware.reload_cart(request)
 			response = TemplateResponse(request, 'sidecart/orders/cart_mini.jinja',
-										{'added_items': added_items, 'quantity': quantity})
+										{'added_items': added_items, 'quantity': lines[-1]['quantity']})
 	except Exception as exp:
-		error(request, _('Error adding that to your {label}: {exp}').format(label=request.cart.CART_LABEL.lower(), exp=exp))
-		response = redirect(variation.url())
+		message = _('Error adding that to your {label}: {exp}').format(label=request.cart.CART_LABEL.lower(), exp=exp)
+		if delta:
+			return HttpResponse(json.dumps({'error': message}), content_type='application/json', status=400)
+		error(request, message)
+		variation = Variation.objects.filter(pk=lines[0]['variation_id']).first() if lines else None
+		response = redirect(variation.url() if variation else 'cart')
 
 	# Otherwise redirect to the right place
 	return response
@@ -150,6 +133,16 @@ def add_to_cart_override(request):
 
 def storelocator_index(request, category_slug=None, product_slug=None, variation_slug=None, item_slug=None):
 
+	# Map panning reissues identical AJAX searches, answer those without searching again.
+	# Tags are only issued for searches that found a location, so a match is always a success.
+	etag = None
+	if request.is_ajax():
+		etag = search_etag(request)
+		if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+			response = HttpResponseNotModified()
+			response['ETag'] = etag
+			return response
+
 	# Grab location from POST or session
 	query = request.GET.get('location', '')
 	radius = int(request.GET.get('radius', 25))
@@ -166,14 +159,16 @@ def storelocator_index(request, category_slug=None, product_slug=None, variation
 	# Geocode location
 	if query:
 		try:
-			result = GoogleV3(api_key=settings.Site.google_api_key).geocode(query)
+			result = geocode(query)
 		except GeocoderQuotaExceeded:
 			error(request, "Our geocoder is currently overloaded - please try again later!")
+		except GeocoderTimedOut:
+			error(request, "Our geocoder is taking too long to respond - please try again later!")
 		else:
-			try:
-				location = (result.point.latitude, result.point.longitude)
+			if result:
+				location = (result.latitude, result.longitude)
 				query = result.address
-			except AttributeError:
+			else:
 				error(request, "We could not find that location!")
 
 	product = None
@@ -217,27 +212,25 @@ def storelocator_index(request, category_slug=None, product_slug=None, variation
 
 	if category_slug == 'costco-roadshow':
 		category = get_object_or_404(LocatorCategory, slug=category_slug, active=True)
-		stores = CostcoRoadShow.objects.exclude(online=True).filter(locality=locality)
-		if date:
-			stores = stores.filter((Q(start_date__month=date.month) & Q(start_date__year=date.year)) |
-									(Q(end_date__month=date.month) & Q(end_date__year=date.year)))
+		calendar = CostcoRoadShow.calendar()
+		stores = CostcoRoadShow.objects.filter(pk__in=calendar.lookup(locality, date))
 	else:
 		# Grab nearby locations
 		if location:
 			all_stores = Location.objects.active().exclude(online=True)
+			categories = None
 			if category_slug:
 				category = get_object_or_404(LocatorCategory, slug=category_slug, active=True)
-				all_stores = all_stores.filter(categories__in=category.get_descendants(include_self=True))
-			stores = all_stores.within_radius(location, radius=radius)
+				categories = set(category.get_descendants(include_self=True).values_list('pk', flat=True))
+			index = store_index.get()
+			mask = None
 			if product_slug or filters:
-				stores = stores.with_inventory(variations, product_slug, variation_slug, item_slug)
-			if not stores:
-				if not product_slug and not filters:
-					stores = all_stores.order_by_distance_from(location)[:1]
-					closest = True
-			else:
-				stores = sorted(stores, key=lambda l: l.distance_from(location).km)
-		elif settings.STORELOCATOR_ALWAYS_LOAD_ALL_STORES:
+				mask = inventory_index.get().mask(index, variations, product_slug, variation_slug, item_slug)
+			stores = annotate(all_stores, *index.within_radius(location, radius, categories, mask))
+			if not stores and not product_slug and not filters:
+				stores = annotate(all_stores, *index.nearest(location, 1, categories))
+				closest = True
+		elif settings.STORELOCATOR_ALWAYS_LOAD_ALL_STORES and not getattr(settings, 'STORELOCATOR_CLUSTER_TILES', False):
 			stores = Location.objects.active()
 
 	# Set context
@@ -247,20 +240,24 @@ def storelocator_index(request, category_slug=None, product_slug=None, variation
 			'lat': location[0] if location else '39.8282',
 			'lng': location[1] if location else '-98.5795',
 		},
-		'stores': LocationSerializer(stores, many=True, origin=location, query=query).data if request.is_ajax() else stores,
+		'stores': stores,
 		'query': query,
 		'closest': closest,
-		'radius': radius
+		'radius': radius,
+		'cluster_tiles': getattr(settings, 'STORELOCATOR_CLUSTER_TILES', False)
 	}
 
-	# json serializer doesn't like addresses and decimals
-
 	# Return response
 	if request.is_ajax():
-		response = HttpResponse(json.dumps(context), content_type='application/json')
+		response = StreamingHttpResponse(stream_json(context, 'stores', store_fragments(stores)), content_type='application/json')
+		# Failed or timed out geocodes must be retried, not revalidated
+		if location:
+			response['ETag'] = etag
 	else:
 		for store in context['stores']:
-			store.distance = int(store.distance_from(location).miles)
+			# Stores found through the index already carry their distance
+			if not hasattr(store, 'distance_km'):
+				store.distance = int(store.distance_from(location).miles)
 		context['product'] = product
 		context['variation'] = variation
 		context['item'] = item
@@ -271,19 +268,13 @@ def storelocator_index(request, category_slug=None, product_slug=None, variation
 		context['online_stores'] = Location.objects.active().online().order_by('name')
 
 		if category_slug == 'costco-roadshow':
-			costco_dates = CostcoRoadShow.objects.exclude(online=True).order_by('start_date').values_list('start_date', 'end_date')
-			display_dates = {}
-			for date in costco_dates:
-				display_dates[datetime(year=date[0].year, month=date[0].month, day=1)] = 1
-				display_dates[datetime(year=date[1].year, month=date[1].month, day=1)] = 1
-
-			context['dates'] = list(sorted(display_dates.items(), key=lambda t: t[0]))
+			context['dates'] = [(month, 1) for month in calendar.months]
 			context['date'] = request.GET.get('date', '')
-			context['states'] = CostcoRoadShow.objects.exclude(online=True).prefetch_related('locality').order_by('locality').values_list('locality__name', 'locality__id').distinct()
+			context['states'] = calendar.states
 			context['locality'] = locality
 
 		try:
-			context['page'] = Page.objects.public().get(slug='find-a-store')
+			context['page'] = get_page('find-a-store', public=True)
 		except Page.DoesNotExist:
 			pass
 		response = TemplateResponse(request, 'storelocator/index.jinja', context)
@@ -291,16 +282,38 @@ def storelocator_index(request, category_slug=None, product_slug=None, variation
 	return response
 
 
+def storelocator_clusters(request, zoom, x, y):
+	"Clustered store markers for one map tile, single stores serialized in full"
+	zoom, x, y = int(zoom), int(x), int(y)
+	# Only real tiles are answered, so arbitrary coordinates can't fill the cache
+	if zoom > getattr(settings, 'STORELOCATOR_MAP_MAX_ZOOM', 22) or x >= 2 ** zoom or y >= 2 ** zoom:
+		raise Http404
+	key = 'goalzero:clusters:{}:{}:{}:{}'.format(store_index.version(), zoom, x, y)
+	content = cache.get(key)
+	if content is None:
+		markers = [dict(marker) for marker in store_index.get().clusters().tile(zoom, x, y)]
+		singles = [marker['id'] for marker in markers if marker['count'] == 1]
+		if singles:
+			found = Location.objects.in_bulk(singles)
+			ordered = [found[pk] for pk in singles if pk in found]
+			serialized = dict(zip((store.pk for store in ordered), LocationSerializer(ordered, many=True).data))
+			for marker in markers:
+				if marker['count'] == 1:
+					marker['store'] = serialized.get(marker['id'])
+		content = json.dumps({'zoom': zoom, 'x': x, 'y': y, 'markers': markers})
+		cache.set(key, content, getattr(settings, 'STORELOCATOR_CLUSTER_CACHE_TTL', 60 * 60 * 24))
+	return HttpResponse(content, content_type='application/json')
+
+
 def storelocator_url_resolver_override(request, *args, **kwargs):
 	# Split by slash and remove last empty element
 	args = args[0].rstrip('/').split('/')
-	try:
-		product_args = args[:4]
-		if len(product_args) < 1 or len(product_args) > 4:
-			raise Http404
-		return storelocator_index(request, *product_args, **kwargs)
-	except Http404:
-		return storelocator_index(request, args)
+	# Either category/product/variation/item or product/variation/item
+	if args[0] in category_slugs.get() and len(args) <= 4:
+		return storelocator_index(request, *args, **kwargs)
+	if args[0] in product_slugs.get() and len(args) <= 3:
+		return storelocator_index(request, None, *args, **kwargs)
+	raise Http404
 
 
 def get_sort(request):
@@ -316,14 +329,16 @@ def blog_index(request, category_path=None, page=1, year=None, month=None, featu
 	context = blog_default_context()
 	current_sort = get_sort(request)
 
-	excluded_categories = PostCategory.objects.filter(slug__in=['history']).values_list('pk', flat=True)
+	excluded_categories = PostCategory.objects.filter(slug__in=EXCLUDED_CATEGORIES).values_list('pk', flat=True)
 
 	context['categories'] = context['categories'].exclude(pk__in=excluded_categories)
 
+	taxonomy = blog_taxonomy.get()
+	category = None
 	if category_path:
-		category = None
-		for category_slug in category_path:
-			category = get_object_or_404(PostCategory, slug=category_slug, parent=category)
+		category = taxonomy.category(category_path)
+		if category is None:
+			raise Http404
 		context['category'] = category
 		posts = category.posts().public().distinct()
 	else:
@@ -335,13 +350,17 @@ def blog_index(request, category_path=None, page=1, year=None, month=None, featu
 		try:
 			start_date = datetime(int(year), int(month) if month else 1, 1, tzinfo=pytz.utc)
 			end_date = start_date + (relativedelta(months=1) if month else relativedelta(years=1))
-			posts = posts.filter(publish_date__range=(start_date, end_date))
 		except ValueError:
 			raise Http404
+		posts = posts.filter(publish_date__range=(start_date, end_date))
+	context['archive'] = taxonomy.archive(category)
 
 	posts = posts.prefetch_related('categories')
 
-	posts = posts.order_by(current_sort.posts_order)
+	order = current_sort.posts_order
+	# Cursors continue from the last post of an offset page, so both must break ties the same way
+	posts = posts.order_by(*keyset_order(order))
+	ordered = posts
 
 	featured_count = featured_override if featured_override is not False else int(settings.Blog.features)
 	# Allow other views to override the number of featured posts so we can get all of the posts
@@ -350,14 +369,24 @@ def blog_index(request, category_path=None, page=1, year=None, month=None, featu
 		context['features'] = features
 
 	# Allow other views to override the posts_per_page value, fall back to the setting
-	paginator = Paginator(posts, getattr(request, 'posts_per_page', settings.Blog.posts_per_page))
-
-	try:
-		posts = paginator.page(page)
-	except PageNotAnInteger:
-		posts = paginator.page(1)
-	except EmptyPage:
-		posts = paginator.page(paginator.num_pages)
+	per_page = getattr(request, 'posts_per_page', settings.Blog.posts_per_page)
+	count_key = '{}:{}:{}:{}:{}'.format(context.get('category') and context['category'].pk, year, month, featured_count, order)
+	paginator = CachedCountPaginator(posts, per_page, count_key)
+
+	# Cursor links (?after=) page with an indexed range instead of OFFSET
+	cursor = decode_cursor(request.GET.get('after', ''))
+	if cursor:
+		posts = keyset_page(ordered, order, cursor, paginator)
+		context['next_cursor'] = posts.next_cursor
+	else:
+		try:
+			posts = paginator.page(page)
+		except PageNotAnInteger:
+			posts = paginator.page(1)
+		except EmptyPage:
+			posts = paginator.page(paginator.num_pages)
+		if posts.has_next() and posts.object_list:
+			context['next_cursor'] = encode_cursor(list(posts.object_list)[-1], order, posts.number + 1)
 
 	context['paginator'] = paginator
 	context['posts'] = posts
@@ -367,7 +396,7 @@ def blog_index(request, category_path=None, page=1, year=None, month=None, featu
 	context['blog_sorts'] = settings.SIDEPOST_POSTS_SORTS,
 
 	try:
-		page = Page.objects.public().get(slug='blog-landing')
+		page = get_page('blog-landing', public=True)
 		context['page'] = page
 	except Page.DoesNotExist:
 		pass
@@ -378,29 +407,30 @@ def blog_index(request, category_path=None, page=1, year=None, month=None, featu
 def blog_url_resolver_override(request, *args, **kwargs):
 	# Split by slash and remove last empty element
 	args = args[0].rstrip('/').split('/')
-	try:
-		if len(args) != 1:
-			raise Http404
-		return blog_detail(request, *args, **kwargs)
-	except Http404:
-		kwargs = {}
-		# Handle pagination argument
-		if 'page' in args:
-			try:
-				kwargs['page'] = args.pop(args.index('page') + 1)
-			except IndexError:
-				pass
-			else:
-				args.remove('page')
-		if 'archive' in args:
-			try:
-				kwargs['year'] = args.pop(args.index('archive') + 1)
-				kwargs['month'] = args.pop(args.index('archive') + 1)
-			except IndexError:
-				pass
-			if 'year' in kwargs:
-				args.remove('archive')
-		return blog_index(request, args, **kwargs)
+	if len(args) == 1 and args[0] in post_slugs.get():
+		try:
+			return blog_detail(request, *args, **kwargs)
+		except Http404:
+			pass
+
+	kwargs = {}
+	# Handle pagination argument
+	if 'page' in args:
+		try:
+			kwargs['page'] = args.pop(args.index('page') + 1)
+		except IndexError:
+			pass
+		else:
+			args.remove('page')
+	if 'archive' in args:
+		try:
+			kwargs['year'] = args.pop(args.index('archive') + 1)
+			kwargs['month'] = args.pop(args.index('archive') + 1)
+		except IndexError:
+			pass
+		if 'year' in kwargs:
+			args.remove('archive')
+	return blog_index(request, args, **kwargs)
 
 
 def product_features(request, page_slug):
@@ -408,7 +438,9 @@ def product_features(request, page_slug):
 	try:
 		page = FeaturedPage.objects.get(slug=page_slug)
 		context['featured_page'] = page
-	except Page.DoesNotExist:
+		context['assembled'] = page.assembled()
+		context['rendered_blocks'] = context['assembled'].rendered_blocks(request)
+	except FeaturedPage.DoesNotExist:
 		raise Http404
 
 	return TemplateResponse(request, 'goalzero/product_features.jinja', context)
@@ -416,40 +448,31 @@ def product_features(request, page_slug):
 
 def story(request):
 	try:
-		page = Page.objects.get(slug='story')
+		page = get_page('story')
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Story page missing!')
-	posts = Post.objects.public().filter(categories__slug='history').order_by('publish_date')
-	posts_by_year = collections.OrderedDict()
-	for post in posts:
-		if posts_by_year.get(post.publish_date.year):
-			posts_by_year[post.publish_date.year].append(post)
-		else:
-			posts_by_year[post.publish_date.year] = [post]
-	context = {
-		'page': page,
-		'history_categories': posts_by_year,
-		'story_members': Member.objects.filter(categories__name="members")
-	}
+	# story_version lets the template fragment-cache the timeline until posts or members change
+	context = dict(story_timeline.get(), page=page, story_version=story_timeline.version())
 	return TemplateResponse(request, 'sidepost/pages/story.jinja', context)
 
 
 def how_it_works(request):
 	try:
-		page = Page.objects.get(slug='how-it-works')
+		page = get_page('how-it-works')
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('How It Works page missing!')
 
 	context = {
 		'page': page,
-		'products_data': json.dumps(dict(((v.code, (v.thumb().url, v.url())) for v in Product.objects.all() if v.thumb())))
+		'products_data': media_manifest.get(),
+		'products_data_version': media_manifest.version()
 	}
 	return TemplateResponse(request, 'goalzero/how_it_works.jinja', context)
 
 
 def coop(request):
 	try:
-		page = Page.objects.get(slug='coop')
+		page = get_page('coop')
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Story page missing!')
 	context = {
@@ -460,22 +483,44 @@ def coop(request):
 
 def registration_index_override(request):
 	try:
-		page = Page.objects.get(slug='product-registration')
+		page = get_page('product-registration')
 	except Page.DoesNotExist:
 		raise Page.DoesNotExist('Product Registration page missing!')
 
-	products_type = {}
-	for cat in Category.objects.filter(parent__slug="shop"):
-		products_type[cat.name] = [item for prod in cat.products() for item in prod.variations().values_list('name', 'code')]
+	serial_checks = []
+	if request.method == 'POST':
+		# The form belongs to sidecart, so repeats are flagged rather than refused
+		serials = [value for name, value in request.POST.items() if name.endswith('serial_number') and value.strip()]
+		serial_checks = check_serials(serials)
+		for serial, key, status in serial_checks:
+			if status == REGISTERED:
+				warning(request, _('Serial number {serial} has already been registered.').format(serial=serial))
+			elif status == DUPLICATE:
+				warning(request, _('Serial number {serial} was entered more than once.').format(serial=serial))
+
 	tpl = registration_index(request)
 	try:
 		if getattr(tpl, 'context_data'):
-			tpl.context_data['products_type'] = json.dumps(products_type)
+			tpl.context_data['products_type'] = registration_catalog.get()
 			tpl.context_data['page'] = page
+			tpl.context_data['serial_checks'] = serial_checks
 	except AttributeError:
 		pass
 	return tpl
 
+@staff_member_required
+def registration_export(request):
+	"Stream every registration or registered product as CSV or NDJSON for warranty partners"
+	model = export_model(request.GET.get('model', 'product'))
+	format = request.GET.get('format', 'csv')
+	if model is None or format not in EXPORT_FORMATS:
+		raise Http404
+	export, content_type = EXPORT_FORMATS[format]
+	response = StreamingHttpResponse(export(model), content_type=content_type)
+	response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(model._meta.model_name, format)
+	return response
+
+
 # BazaarVoice container page (http://knowledge.bazaarvoice.com/wp-content/conversations/en_US/KB/#Code_integration/Container_page_code.htm)
 def container(request):
 	return TemplateResponse(request, 'goalzero/container.jinja', {})
\ No newline at end of file